@@ -49,6 +49,12 @@ INSERT INTO `cantb` (`id`, `Name`, `PartName`, `PartCode`, `Image`, `Address`) V
 --
 -- Table structure for table `regtb`
 --
+-- Indexed for the admin voter search; existing tables get the same keys with
+--   ALTER TABLE regtb ADD KEY `VoterId` (`VoterId`), ADD KEY `AadharId` (`AadharId`),
+--     ADD KEY `UserName` (`UserName`, `VoterId`), ADD KEY `FatherName` (`FatherName`),
+--     ADD KEY `Address` (`Address`, `UserName`, `VoterId`),
+--     ADD FULLTEXT KEY `Names` (`UserName`, `FatherName`);
+--
 
 CREATE TABLE `regtb` (
   `UserName` varchar(250) NOT NULL,
@@ -62,7 +68,13 @@ CREATE TABLE `regtb` (
   `AadharId` varchar(250) NOT NULL,
   `FImage` varchar(500) NOT NULL,
   `Pukey` varchar(250) NOT NULL,
-  `PvKey` varchar(250) NOT NULL
+  `PvKey` varchar(250) NOT NULL,
+  KEY `VoterId` (`VoterId`),
+  KEY `AadharId` (`AadharId`),
+  KEY `UserName` (`UserName`, `VoterId`),
+  KEY `FatherName` (`FatherName`),
+  KEY `Address` (`Address`, `UserName`, `VoterId`),
+  FULLTEXT KEY `Names` (`UserName`, `FatherName`)
 ) ENGINE=InnoDB DEFAULT CHARSET=latin1;
 
 --
@@ -96,6 +108,18 @@ INSERT INTO `temptb` (`id`, `UserName`, `Status`) VALUES
 --
 -- Table structure for table `votedtb`
 --
+-- Partitioned by the voter's constituency; each constituency keeps its
+-- own Hash1/Hash2 chain. Existing tables are converted with
+--   ALTER TABLE votedtb ADD `Constituency` varchar(250) NOT NULL default '',
+--     DROP PRIMARY KEY, ADD PRIMARY KEY (`id`, `Constituency`),
+--     ADD KEY `Chain` (`Constituency`, `id`), ADD KEY `VoterId` (`VoterId`),
+--     ADD KEY `PartCode` (`PartCode`);
+--   ALTER TABLE votedtb PARTITION BY KEY (`Constituency`) PARTITIONS 16;
+--   ALTER TABLE votedtb ADD `CastTime` datetime NULL,
+--     ALTER `CastTime` SET DEFAULT CURRENT_TIMESTAMP;
+-- (votes from before CastTime keep NULL; voteTurnout.py backfill counts them
+-- as untimed)
+--
 
 CREATE TABLE `votedtb` (
   `id` bigint(50) NOT NULL auto_increment,
@@ -105,10 +129,122 @@ CREATE TABLE `votedtb` (
   `count` int(20) NOT NULL,
   `Hash1` varchar(250) NOT NULL,
   `Hash2` varchar(250) NOT NULL,
-  PRIMARY KEY  (`id`)
-) ENGINE=InnoDB DEFAULT CHARSET=latin1 AUTO_INCREMENT=1 ;
+  `Constituency` varchar(250) NOT NULL default '',
+  `CastTime` datetime NULL default CURRENT_TIMESTAMP,
+  PRIMARY KEY  (`id`, `Constituency`),
+  KEY `Chain` (`Constituency`, `id`),
+  KEY `VoterId` (`VoterId`),
+  KEY `PartCode` (`PartCode`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1 AUTO_INCREMENT=1
+PARTITION BY KEY (`Constituency`) PARTITIONS 16 ;
 
 --
 -- Dumping data for table `votedtb`
 --
 
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `chaintb`
+--
+-- Tip of each constituency's vote chain. Its row lock orders votes when
+-- several App.py nodes serve one election; rows are created on the
+-- first vote from the existing votedtb tip.
+--
+
+CREATE TABLE `chaintb` (
+  `Constituency` varchar(250) NOT NULL,
+  `Tip` varchar(250) NOT NULL,
+  PRIMARY KEY  (`Constituency`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `sesstb`
+--
+-- Verification contexts shared by all App.py nodes (VOTE_SESSION_STORE=db)
+--
+
+CREATE TABLE `sesstb` (
+  `Token` varchar(64) NOT NULL,
+  `Data` text NOT NULL,
+  `Expires` bigint(20) NOT NULL,
+  PRIMARY KEY  (`Token`),
+  KEY `Expires` (`Expires`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `synctb`
+--
+-- Last boothvotes sequence each offline booth has synced
+--
+
+CREATE TABLE `synctb` (
+  `Booth` varchar(250) NOT NULL,
+  `Seq` bigint(50) NOT NULL,
+  PRIMARY KEY  (`Booth`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `conflicttb`
+--
+-- Booth votes of voters who had already voted elsewhere; not counted
+--
+
+CREATE TABLE `conflicttb` (
+  `Booth` varchar(250) NOT NULL,
+  `Seq` bigint(50) NOT NULL,
+  `VoterId` varchar(250) NOT NULL,
+  `PartCode` varchar(250) NOT NULL,
+  `Constituency` varchar(250) NOT NULL,
+  PRIMARY KEY  (`Booth`, `Seq`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `turnouttb`
+--
+-- Votes per constituency and VOTE_TURNOUT_BUCKET-minute interval, kept by
+-- the vote paths; rebuilt with python voteTurnout.py backfill
+--
+
+CREATE TABLE `turnouttb` (
+  `Constituency` varchar(250) NOT NULL,
+  `Bucket` datetime NOT NULL,
+  `Votes` int(20) NOT NULL,
+  PRIMARY KEY  (`Constituency`, `Bucket`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `regcounttb`
+--
+-- Registered voters per constituency (regtb.Address) and the votes that
+-- have no CastTime
+--
+
+CREATE TABLE `regcounttb` (
+  `Constituency` varchar(250) NOT NULL,
+  `Registered` int(20) NOT NULL default '0',
+  `Untimed` int(20) NOT NULL default '0',
+  PRIMARY KEY  (`Constituency`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `facetb`
+--
+
+CREATE TABLE `facetb` (
+  `VoterId` varchar(250) NOT NULL,
+  `ProfileId` bigint(50) NOT NULL,
+  PRIMARY KEY  (`VoterId`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
@@ -1,14 +1,105 @@
-from flask import Flask, render_template, flash, request, session
+from flask import Flask, render_template, flash, request, session, g, Response, stream_with_context, jsonify
 from flask import render_template, redirect, url_for, request
-import mysql.connector
-import sys, fsdk, math, ctypes, time
+import sys, math, ctypes, time
 import datetime
-from ecies.utils import generate_key
-from ecies import encrypt, decrypt
-import base64, os
+import base64, os, uuid
+import appWarmup
+import voterFaceIndex
+import appMetrics
+import sessionStore
+import voteJournal
+import voteTally
+import admission
+import liveResults
+import boothSync
+import voterSearch
+import voteTurnout
+import candidateImages
+import dbRouter
 app = Flask(__name__)
 app.config['DEBUG']
 app.config['SECRET_KEY'] = '7d441f27d441f27567d441f2b6176a'
+log = appMetrics.getLogger()
+
+
+def dbconnect(readonly=False):
+    with appMetrics.timed('db_connect_seconds'):
+        return appMetrics.instrument(dbRouter.connect(readonly))
+
+
+def reportconnect():
+    # admin listings and result pages may be served by a replica
+    return dbconnect(readonly=True)
+
+
+def boothconnect():
+    # the voter flow runs on the booth's local replica in booth mode
+    if boothSync.enabled():
+        return boothSync.connect()
+    return dbconnect()
+
+
+# several App.py nodes can serve one election: point VOTE_BLOB_DIR at a
+# directory they all share and set VOTE_SESSION_STORE=db so the
+# verification contexts live in sesstb instead of one node's memory
+BLOB_DIR = os.environ.get('VOTE_BLOB_DIR', 'static')
+if os.environ.get('VOTE_SESSION_STORE') == 'db':
+    sessionStore.use_database(dbconnect)
+
+
+def blob(kind, name=''):
+    return os.path.join(BLOB_DIR, kind, name)
+
+
+def upload_name():
+    # 4-digit random names collide once nodes share the upload directory
+    return uuid.uuid4().hex + ".png"
+
+
+if BLOB_DIR != 'static':
+    @app.route("/static/upload/<path:filename>")
+    def blob_upload(filename):
+        return candidateImages.send(blob('upload'), filename)
+
+
+def static_files(filename):
+    # pre-compressed twins, ETags, immutable caching of content-hashed images
+    return candidateImages.send(app.static_folder, filename)
+
+
+app.view_functions['static'] = static_files
+
+
+def ballot(rows):
+    # candidates on the ballot are shown as thumbnails, WebP where accepted
+    webp = 'image/webp' in request.headers.get('Accept', '')
+    return candidateImages.ballot(rows, blob('upload'), webp)
+
+
+@app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    route = request.endpoint or 'unknown'
+    appMetrics.observe('http_request_duration_seconds', time.perf_counter() - g.start, route=route, method=request.method)
+    appMetrics.inc('http_requests_total', route=route, status=response.status_code)
+    return response
+
+
+@app.route("/ready")
+def ready():
+    # 200 once the subsystems of this worker's VOTE_ROLE are loaded
+    ok, states = appWarmup.status()
+    return jsonify({'role': appWarmup.ROLE, 'ready': ok, 'subsystems': states,
+                    'replicas': dbRouter.status()}), 200 if ok else 503
+
+
+@app.route("/metrics")
+def metrics():
+    return appMetrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
 
 
 @app.route("/")
@@ -41,7 +132,7 @@ def adminlogin():
     error = None
     if request.method == 'POST':
         if request.form['uname'] == 'admin' and request.form['password'] == 'admin':
-            conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+            conn = reportconnect()
             cur = conn.cursor()
             cur.execute("SELECT * FROM regtb")
             data = cur.fetchall()
@@ -53,7 +144,7 @@ def adminlogin():
 
 @app.route("/AdminHome")
 def AdminHome():
-    conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+    conn = reportconnect()
 
     cur = conn.cursor()
     cur.execute("SELECT * FROM regtb")
@@ -68,15 +159,15 @@ def candidate():
         area = request.form['pcode']
         pname = request.form['pname']
         f = request.files['file']
-        f.save("static/upload/" + f.filename)
+        image = candidateImages.save(f, blob('upload'))
         address = request.form['address']
-        conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+        conn = dbconnect()
         cursor = conn.cursor()
-        cursor.execute("insert into cantb value('','" + name + "','" + area + "','" + pname + "','" + f.filename + "','"+ address +"')")
+        cursor.execute("insert into cantb value('','" + name + "','" + area + "','" + pname + "','" + image + "','"+ address +"')")
         conn.commit()
         conn.close()
 
-        conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+        conn = reportconnect()
 
         cur = conn.cursor()
         cur.execute("SELECT * FROM cantb")
@@ -86,17 +177,39 @@ def candidate():
         return render_template('AdminCanInfo.html', data=data)
 
 
+@app.route("/VoterSearch")
+def VoterSearch():
+    # q: name words, VoterId or AadharId; address filters; the next page
+    # is requested with the after/aftervid values of the previous answer
+    after = None
+    if request.args.get('aftervid'):
+        after = (request.args.get('after', ''), request.args['aftervid'])
+    conn = reportconnect()
+    rows, nxt, truncated = voterSearch.search(conn, request.args.get('q', ''), request.args.get('address', ''), after)
+    conn.close()
+    result = {'voters': [dict(zip(voterSearch.COLUMNS, row)) for row in rows]}
+    if nxt:
+        result['after'], result['aftervid'] = nxt
+    if truncated:
+        # only the first voterSearch.FT_CAP matches are paged: ask for more words or an address
+        result['truncated'] = True
+    return jsonify(result)
+
+
 @app.route("/uremove")
 def uremove():
     did = request.args.get('did')
 
-    conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+    conn = dbconnect()
     cursor = conn.cursor()
+    cursor.execute("SELECT Address FROM regtb where VoterId='" + did + "' ")
+    for row in cursor.fetchall():
+        voteTurnout.registered(conn, row[0], -1)
     cursor.execute("delete from regtb  where VoterId='" + did + "' ")
     conn.commit()
     conn.close()
 
-    conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+    conn = reportconnect()
     # cursor = conn.cursor()
     cur = conn.cursor()
     cur.execute("SELECT * FROM regtb ")
@@ -110,13 +223,13 @@ def uremove():
 def remove():
     did = request.args.get('did')
 
-    conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+    conn = dbconnect()
     cursor = conn.cursor()
     cursor.execute("delete from cantb  where Id='" + did + "' ")
     conn.commit()
     conn.close()
 
-    conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+    conn = reportconnect()
     # cursor = conn.cursor()
     cur = conn.cursor()
     cur.execute("SELECT * FROM cantb ")
@@ -128,7 +241,7 @@ def remove():
 
 @app.route("/AdminCanInfo")
 def AdminCanInfo():
-    conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+    conn = reportconnect()
 
     cur = conn.cursor()
     cur.execute("SELECT * FROM cantb")
@@ -138,28 +251,69 @@ def AdminCanInfo():
 
 @app.route("/AdminVoteInfo")
 def AdminVoteInfo():
-    conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+    conn = reportconnect()
     cur = conn.cursor()
     cur.execute("SELECT * FROM votedtb")
     data = cur.fetchall()
 
-    conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
-    cursor = conn.cursor()
-    cursor.execute("SELECT  count(*) as count  FROM votedtb ")
-    data1 = cursor.fetchone()
+    # one counting job per constituency partition, merged
+    count, parties, _ = voteTally.tally(reportconnect)
+    party = [(p,) for p in sorted(parties)]
 
-    if data1:
-        count = data1[0]
-    else:
-        return 'Incorrect username / password !'
+    return render_template('AdminVoteInfo.html', data=data, count=count, party=party)
 
-    conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
 
-    cur = conn.cursor()
-    cur.execute("SELECT distinct PartCode FROM votedtb")
-    party = cur.fetchall()
+results = liveResults.Results(lambda: voteTally.tally(reportconnect)[2])
 
-    return render_template('AdminVoteInfo.html', data=data, count=count, party=party)
+
+@app.route("/results/stream")
+def results_stream():
+    # per-party/per-constituency deltas over Server-Sent Events
+    last = request.headers.get('Last-Event-ID')
+    stream = results.events(int(last) if last and last.isdigit() else None)
+    return Response(stream_with_context(stream), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# archives never change, so each is tallied once per process
+archive_tallies = {}
+
+
+@app.route("/archive/<election>")
+def archive_results(election):
+    # closed elections are tallied and verified straight from the archive files,
+    # in this request thread: no worker processes forked from a Flask worker
+    import voteArchive
+    if election not in voteArchive.elections():
+        return 'Unknown election', 404
+    arc = voteArchive.Archive(election)
+    if election not in archive_tallies:
+        archive_tallies[election] = arc.tally(processes=1)
+    total, parties, constituencies = archive_tallies[election]
+    result = {'election': election, 'archived': arc.manifest['archived'], 'total': total,
+              'parties': parties, 'constituencies': constituencies}
+    if request.args.get('verify'):
+        result['problems'] = arc.verify(processes=1)
+    return jsonify(result)
+
+
+@app.route("/turnout")
+def turnout():
+    # registered vs voted and the per-interval curve, read from the counters
+    conn = reportconnect()
+    result = voteTurnout.curve(conn, request.args.get('constituency'))
+    conn.close()
+    return jsonify({'bucket_minutes': voteTurnout.BUCKET_MINUTES, 'constituencies': result})
+
+
+@app.route("/VoteVerify")
+def VoteVerify():
+    broken = voteTally.verify(reportconnect)
+    if broken:
+        flash('Vote chain broken in ' + ', '.join(sorted(broken)))
+    else:
+        flash('Vote chain verified')
+    return AdminVoteInfo()
 
 
 @app.route("/search", methods=['GET', 'POST'])
@@ -167,12 +321,12 @@ def search():
     if request.method == 'POST':
         party = request.form['party']
 
-        conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+        conn = reportconnect()
         cur = conn.cursor()
         cur.execute("SELECT * FROM votedtb where PartCode='" + party + "' ")
         data = cur.fetchall()
 
-        conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+        conn = reportconnect()
         cursor = conn.cursor()
         cursor.execute("SELECT  count(*) as count  FROM votedtb where PartCode='" + party + "'")
         data1 = cursor.fetchone()
@@ -182,16 +336,26 @@ def search():
         else:
             return 'Incorrect username / password !'
 
-        conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
-
-        cur = conn.cursor()
-        cur.execute("SELECT distinct PartCode FROM votedtb")
-        party = cur.fetchall()
+        _, parties, _ = voteTally.tally(reportconnect)
+        party = [(p,) for p in sorted(parties)]
 
         return render_template('AdminVoteInfo.html', data=data, count=count, party=party)
 
 
+def booth_id():
+    return request.headers.get('X-Booth-Id') or request.remote_addr or ''
+
+
+def vote_priority():
+    # voters further along the flow are served before fresh logins
+    ctx = voter_context()
+    if ctx is None:
+        return 1
+    return -sum(1 for step in sessionStore.STEPS if ctx[step])
+
+
 @app.route("/NewUser")
+@admission.limited('capture', booth_id)
 def NewUser():
     import LiveRecognition  as liv
 
@@ -214,48 +378,50 @@ def NewStudent1():
         aid = request.form['aid']
 
         f = request.files['file']
-        import random
-        pn = random.randint(1111, 9999)
-        f.save("static/upload/" + str(pn) + ".png")
-        fnam = str(pn) + ".png"
+        fnam = upload_name()
+        f.save(blob('upload', fnam))
 
-        secp_k = generate_key()
+        generate_key, encrypt, decrypt = appWarmup.get('crypto')
+        with appMetrics.timed('crypto_seconds', op='generate_key'):
+            secp_k = generate_key()
         privhex = secp_k.to_hex()
         pubhex = secp_k.public_key.format(True).hex()
 
-        filepath = "./static/upload/" + fnam
+        filepath = blob('upload', fnam)
         head, tail = os.path.split(filepath)
 
-        newfilepath1 = './static/Encrypt/' + str(tail)
-        newfilepath2 = './static/Decrypt/' + str(tail)
+        newfilepath1 = blob('Encrypt', tail)
+        newfilepath2 = blob('Decrypt', tail)
 
         data = 0
         with open(filepath, "rb") as File:
             data = base64.b64encode(File.read())  # convert binary to string data to read file
 
-        print("Private_key:", privhex, "\nPublic_key:", pubhex, "Type: ", type(privhex))
+        log.debug("key pair generated for voter %s", vid)
 
         if (privhex == 'null'):
             flash('Please Choose Another File,file corrupted!')
             return render_template('NewUser.html')
 
         else:
-            print("Binary of the file:", data)
-            encrypted_secp = encrypt(pubhex, data)
-            print("Encrypted binary:", encrypted_secp)
+            with appMetrics.timed('crypto_seconds', op='encrypt'):
+                encrypted_secp = encrypt(pubhex, data)
+            log.debug("finger image encrypted: %d -> %d bytes", len(data), len(encrypted_secp))
 
             with open(newfilepath1, "wb") as EFile:
                 EFile.write(base64.b64encode(encrypted_secp))
-            conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+            conn = dbconnect()
             cursor = conn.cursor()
             cursor.execute(
                 "insert into regtb values('" + uname + "','" + fname + "','" + gender + "','" + Age + "','" + email + "','" +
                 pnumber + "','" + address + "','" + vid + "','" + aid + "','" +
                 fnam + "','"+ pubhex +"','"+ privhex +"')")
+            voteTurnout.registered(conn, address, 1)
             conn.commit()
+            voterFaceIndex.link(conn, vid)
             conn.close()
 
-            conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+            conn = reportconnect()
             cur = conn.cursor()
             cur.execute("SELECT * FROM regtb")
             data = cur.fetchall()
@@ -264,6 +430,24 @@ def NewStudent1():
             return render_template("AdminHome.html", data=data)
 
 
+@app.route("/FaceIndex")
+def FaceIndex():
+    conn = dbconnect()
+    try:
+        count = voterFaceIndex.rebuild(conn)
+        flash(str(count) + ' Voter Face Profiles Linked..!')
+    except IOError as e:
+        flash(str(e))
+    conn.close()
+
+    conn = reportconnect()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM regtb")
+    data = cur.fetchall()
+
+    return render_template("AdminHome.html", data=data)
+
+
 
 
 
@@ -271,11 +455,14 @@ def NewStudent1():
 @app.route("/userlogin", methods=['GET', 'POST'])
 def userlogin():
     if request.method == 'POST':
+        if admission.pool('verify').saturated():
+            # shed new logins first so voters already verifying can finish
+            return admission.busy()
         vid = request.form['vid']
 
         session['vid'] = vid
 
-        conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+        conn = boothconnect()
         cursor = conn.cursor()
         cursor.execute("SELECT * from regtb where VoterId='" + vid + "' ")
         data = cursor.fetchone()
@@ -287,12 +474,15 @@ def userlogin():
 
 
         else:
-            print(data[0])
+            log.debug("voter %s logged in", data[7])
             session['vid'] = data[7]
+            sessionStore.drop(session.get('ctx'))
+            session['ctx'] = sessionStore.create(data)
 
-            conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+            conn = boothconnect()
             cursor = conn.cursor()
-            cursor.execute("truncate table temptb")
+            # only this voter's pending OTP; other voters may be mid-flow
+            cursor.execute("delete from temptb where UserName='" + data[7] + "'")
             conn.commit()
             conn.close()
 
@@ -301,16 +491,23 @@ def userlogin():
             # return render_template('OTP.html', data=data )
 
 
+def voter_context():
+    # verification context created by userlogin, None once it has expired
+    return sessionStore.load(session.get('ctx'))
+
+
+def context_expired():
+    flash('Session expired, please login again')
+    return render_template('UserLogin.html')
+
+
 @app.route("/FingerVerify")
 def FingerVerify():
     return render_template('FingerVerify.html')
 
 
-import cv2
-from skimage.metrics import structural_similarity as ssim
-
-
 def image_compare(image1_path, image2_path):
+    cv2, ssim = appWarmup.get('vision')
     # Read the images
     image1 = cv2.imread(image1_path)
     image2 = cv2.imread(image2_path)
@@ -326,52 +523,62 @@ def image_compare(image1_path, image2_path):
 
 
 @app.route("/fingerve", methods=['GET', 'POST'])
+@admission.limited('verify', booth_id, vote_priority)
 def fingerve():
     if request.method == 'POST':
-        vid = session['vid']
+        ctx = voter_context()
+        if ctx is None:
+            return context_expired()
+        vid = ctx['vid']
 
         f = request.files['file']
-        import random
-        pn = random.randint(1111, 9999)
-        f.save("static/upload/" + str(pn) + ".png")
-        img2 = str(pn) + ".png"
+        img2 = upload_name()
+        f.save(blob('upload', img2))
 
-        conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
-        cursor = conn.cursor()
-        cursor.execute("SELECT * from regtb where VoterId='" + vid + "' ")
-        data = cursor.fetchone()
-        if data:
-            img1 = data[9]
-            prkey = data[11]
+        if ctx['fimage']:
+            img1 = ctx['fimage']
+            prkey = ctx['pvkey']
 
             privhex = prkey
 
-            filepath = "./static/Encrypt/" + img1
+            filepath = blob('Encrypt', img1)
             head, tail = os.path.split(filepath)
 
-            newfilepath1 = './static/Encrypt/' + str(tail)
-            newfilepath2 = './static/Decrypt/' + str(tail)
+            newfilepath1 = blob('Encrypt', tail)
+            newfilepath2 = blob('Decrypt', tail)
 
             data = 0
             with open(newfilepath1, "rb") as File:
                 data = base64.b64decode(File.read())
 
-            print(data)
-            decrypted_secp = decrypt(privhex, data)
-            print("\nDecrypted:", decrypted_secp)
+            generate_key, encrypt, decrypt = appWarmup.get('crypto')
+            with appMetrics.timed('crypto_seconds', op='decrypt'):
+                decrypted_secp = decrypt(privhex, data)
+            log.debug("finger image decrypted: %d -> %d bytes", len(data), len(decrypted_secp))
             with open(newfilepath2, "wb") as DFile:
                 DFile.write(base64.b64decode(decrypted_secp))
 
         img1 = newfilepath2
 
-        img2 = "static/upload/" + img2
+        img2 = blob('upload', img2)
         try:
-            similarity_index = image_compare(img1, img2)
-            print(similarity_index)
+            with appMetrics.timed('image_compare_seconds'):
+                similarity_index = image_compare(img1, img2)
+            log.info("finger SSIM %.4f for voter %s", similarity_index, vid)
         except:
+            log.warning("finger image compare failed for voter %s", vid, exc_info=True)
             similarity_index = 0
 
         if int(similarity_index) == 1.0:
+            sessionStore.passed(session['ctx'], 'finger')
+            conn = boothconnect()
+            linked = voterFaceIndex.profile_id(conn, vid)
+            conn.close()
+            if linked is not None:
+                # 1:1 check against the voter's own face profile at /faceverify
+                return render_template('FaceVerify.html')
+
+            # not linked to a face profile yet: live 1:N recognition
             import LiveRecognition1  as liv1
             del sys.modules["LiveRecognition1"]
 
@@ -383,29 +590,65 @@ def fingerve():
 
 
 
-def examvales1():
-    vid = session['vid']
-    conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
-    cursor = conn.cursor()
-    cursor.execute("SELECT  *  FROM regtb where  VoterId='" + vid + "'")
-    data = cursor.fetchone()
+@app.route("/faceverify", methods=['GET', 'POST'])
+@admission.limited('verify', booth_id, vote_priority)
+def faceverify():
+    if request.method == 'POST':
+        ctx = voter_context()
+        if ctx is None:
+            return context_expired()
+        if not ctx['finger']:
+            flash('Finger verification not completed')
+            return render_template('FingerVerify.html')
+        vid = ctx['vid']
 
-    if data:
-        Email = data[4]
-        Phone = data[5]
-        session['address'] = data[6]
+        f = request.files['file']
+        import random
+        upload = blob('upload', upload_name())
+        f.save(upload)
+
+        conn = boothconnect()
+        with appMetrics.timed('face_verify_seconds'):
+            matched = voterFaceIndex.verify(conn, vid, upload)
+        if matched is None:
+            # no enrolled face profile for this voter: use live 1:N recognition
+            import LiveRecognition1  as liv1
+            del sys.modules["LiveRecognition1"]
+            return Vote1()
 
-    else:
+        if matched:
+            sessionStore.passed(session['ctx'], 'face')
+            otp = str(random.randint(1111, 9999))
+            cursor = conn.cursor()
+            cursor.execute("insert into temptb values('0','" + vid + "','" + otp + "')")
+            conn.commit()
+            conn.close()
+            sendmsg(ctx['phone'], otp)
+            return Vote1()
+
+        else:
+            flash('Face  is wrong')
+            return render_template('FaceVerify.html')
+
+
+def examvales1():
+    ctx = voter_context()
+    if ctx is None:
         return 'Incorrect username / password !'
 
-    return vid, Email, Phone
+    return ctx['vid'], ctx['email'], ctx['phone']
 
 
 @app.route("/Vote1")
 def Vote1():
-    vid = session['vid']
-    address = session['address']
-    conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+    ctx = voter_context()
+    if ctx is None:
+        return context_expired()
+    if not ctx['finger']:
+        flash('Finger verification not completed')
+        return render_template('FingerVerify.html')
+    vid = ctx['vid']
+    conn = boothconnect()
     cursor = conn.cursor()
     cursor.execute("SELECT * from temptb where UserName='" + vid + "' ")
     data = cursor.fetchone()
@@ -417,14 +660,16 @@ def Vote1():
 
 
     else:
+        # the temptb row is written once the face step has matched
+        sessionStore.passed(session['ctx'], 'face')
 
-        conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+        conn = boothconnect()
 
         cur = conn.cursor()
         cur.execute("SELECT * FROM cantb")
         data = cur.fetchall()
 
-        return render_template('OTP.html', data=data)
+        return render_template('OTP.html', data=ballot(data))
 
 
 @app.route("/otp", methods=['GET', 'POST'])
@@ -433,10 +678,13 @@ def otp():
         otp = request.form['vid']
 
         # session['vid'] = vid
-        address = session['address']
-        conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+        ctx = voter_context()
+        if ctx is None:
+            return context_expired()
+        address = ctx['address']
+        conn = boothconnect()
         cursor = conn.cursor()
-        cursor.execute("SELECT * from temptb where Status='" + otp + "' ")
+        cursor.execute("SELECT * from temptb where UserName='" + ctx['vid'] + "' and Status='" + otp + "' ")
         data = cursor.fetchone()
         if data is None:
 
@@ -446,24 +694,25 @@ def otp():
 
 
         else:
+            sessionStore.passed(session['ctx'], 'otp')
 
-            conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+            conn = boothconnect()
 
             cur = conn.cursor()
             cur.execute("SELECT * FROM cantb where Address='"+ address +"'")
             data = cur.fetchall()
 
-            return render_template('Vote.html', data=data)
+            return render_template('Vote.html', data=ballot(data))
 
 
 @app.route("/Vote")
 def Vote():
-    conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+    conn = boothconnect()
 
     cur = conn.cursor()
     cur.execute("SELECT * FROM cantb")
     data = cur.fetchall()
-    return render_template('Vote.html', data=data)
+    return render_template('Vote.html', data=ballot(data))
 
 
 import hmac
@@ -478,13 +727,67 @@ def create_sha256_signature(key, message):
     return hmac.new(byte_key, message, hashlib.sha256).hexdigest().upper()
 
 
+def next_hash():
+    return create_sha256_signature("E49756B4C8FAB4E48222A3E7F3B97CC3", str(random.randrange(1111, 9999)))
+
+
+if boothSync.enabled():
+    boothSync.start(dbconnect, next_hash)
+
+
+def booth_vote(vid, PartCode, image, constituency):
+    # booth mode: the vote is committed to the booth's local journal and
+    # synced to the central votedtb in batches; a vote cast at another
+    # booth too shows up there as a conflict
+    conn = boothconnect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * from votedtb where VoterId='" + vid + "' ")
+    data = cursor.fetchone()
+    if data is None and boothSync.record(conn, vid, PartCode, image, constituency):
+        results.record(constituency, PartCode)
+        flash('Vote Completed!')
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM cantb")
+        data = cur.fetchall()
+        conn.close()
+        return render_template('Vote.html', data=ballot(data))
+
+    conn.close()
+    flash('Already Vote this User')
+    return render_template('Vote.html')
+
+
+def journal_vote(vid, PartCode, image, constituency):
+    # journal mode: the vote is acknowledged once it is on disk, the
+    # flusher inserts it into votedtb and extends the hash chain
+    journal = voteJournal.get(dbconnect, next_hash)
+    conn = dbconnect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * from votedtb where VoterId='" + vid + "' ")
+    data = cursor.fetchone()
+    conn.close()
+    if data is None and journal.append(vid, PartCode, image, constituency):
+        results.record(constituency, PartCode)
+        flash('Vote Completed!')
+        conn = dbconnect()
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM cantb")
+        data = cur.fetchall()
+        return render_template('Vote.html', data=ballot(data))
+
+    flash('Already Vote this User')
+    return render_template('Vote.html')
+
+
 @app.route("/uvote")
 def uvote():
-    did = request.args.get('did')
+    did = request.args.get('did', '')
+    if not did.isdigit():
+        return 'Incorrect username / password !'
 
-    conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+    conn = boothconnect()
     cursor = conn.cursor()
-    cursor.execute("SELECT  *  FROM cantb where  id='" + did + "'")
+    cursor.execute("SELECT  *  FROM cantb where  id=%s", (int(did),))
     data = cursor.fetchone()
 
     if data:
@@ -496,75 +799,52 @@ def uvote():
     else:
         return 'Incorrect username / password !'
 
-    vid = session['vid']
-
-    conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+    ctx = voter_context()
+    if ctx is None:
+        return context_expired()
+    if not all(ctx[step] for step in sessionStore.STEPS):
+        flash('Verification not completed')
+        return render_template('UserLogin.html')
+    vid = ctx['vid']
+
+    if boothSync.enabled():
+        return booth_vote(vid, PartCode, image, ctx['address'])
+    if voteJournal.enabled():
+        return journal_vote(vid, PartCode, image, ctx['address'])
+
+    # every constituency extends its own hash chain; the tip stays
+    # locked until the commit so app nodes take turns. a voter always
+    # locks their own constituency's chain, so once it is held the check
+    # sees any vote another node committed for them
+    conn, tips = voteTally.lock_chains(dbconnect, [ctx['address']])
+    hash1 = tips[ctx['address']]
     cursor = conn.cursor()
-    cursor.execute("SELECT * from votedtb where VoterId='" + vid + "' ")
+    cursor.execute("SELECT id from votedtb where VoterId='" + vid + "' for update")
     data = cursor.fetchone()
     if data is None:
 
-        conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
-        cursor = conn.cursor()
-        cursor.execute("SELECT  *  FROM votedtb ")
-        data = cursor.fetchone()
-
-        if data:
-
-            conn1 = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
-            cursor1 = conn1.cursor()
-            cursor1.execute("select max(id) from votedtb")
-            da = cursor1.fetchone()
-            if da:
-                d = da[0]
-                print(d)
-
-            conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
-            cursor = conn.cursor()
-            cursor.execute("SELECT  *  FROM votedtb where  id ='" + str(d) + "'   ")
-            data = cursor.fetchone()
-            if data:
-                hash1 = data[6]
-                num1 = random.randrange(1111, 9999)
-                hash2 = create_sha256_signature("E49756B4C8FAB4E48222A3E7F3B97CC3", str(num1))
-
-                conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
-                cursor = conn.cursor()
-                cursor.execute(
-                    "insert into votedtb value('','" + vid + "','" + PartCode + "','" + image + "','1','" + hash1 + "','" + hash2 + "')")
-                conn.commit()
-                conn.close()
-
-                flash('Vote Completed!')
-                conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
-                cur = conn.cursor()
-                cur.execute("SELECT * FROM cantb")
-                data = cur.fetchall()
-                return render_template('Vote.html', data=data)
-
-        else:
-
-            hash1 = '0'
-            num1 = random.randrange(1111, 9999)
-            hash2 = create_sha256_signature("E49756B4C8FAB4E48222A3E7F3B97CC3", str(num1))
-
-            conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
-            cursor = conn.cursor()
-            cursor.execute(
-                "insert into votedtb value('','" + vid + "','" + PartCode + "','" + image + "','1','" + hash1 + "','" + hash2 + "')")
-            conn.commit()
-            conn.close()
+        log.debug("vote chain tip %s for %s", hash1, ctx['address'])
+        hash2 = next_hash()
+        cursor.execute(
+            "insert into votedtb (VoterId, PartCode, Image, count, Hash1, Hash2, Constituency) values('" + vid + "','" + PartCode + "','" + image + "','1','" + hash1 + "','" + hash2 + "','" + ctx['address'] + "')")
+        voteTally.advance(conn, ctx['address'], hash2)
+        voteTurnout.vote(conn, ctx['address'])
+        conn.commit()
+        conn.close()
+        results.record(ctx['address'], PartCode)
 
-            flash('Vote Completed!')
-            conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
-            cur = conn.cursor()
-            cur.execute("SELECT * FROM cantb")
-            data = cur.fetchall()
-            return render_template('Vote.html', data=data)
+        flash('Vote Completed!')
+        conn = dbconnect()
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM cantb")
+        data = cur.fetchall()
+        return render_template('Vote.html', data=ballot(data))
 
 
 
     else:
+        conn.rollback()
+        conn.close()
         flash('Already Vote this User')
         return render_template('Vote.html')
 
@@ -575,5 +855,9 @@ def sendmsg(targetno, message):
         "http://sms.creativepoint.in/api/push.json?apikey=6555c521622c1&route=transsms&sender=FSSMSS&mobileno=" + targetno + "&text=Dear customer your msg is " + message + "  Sent By FSMSG FSSMSS")
 
 
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    # the reloader's watcher process serves nothing; only its child warms up
+    appWarmup.warm()
+
 if __name__ == '__main__':
     app.run(debug=True, use_reloader=True)
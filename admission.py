@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import wraps
+
+import appMetrics
+
+log = appMetrics.getLogger()
+
+# concurrency limits for the expensive verification routes. each pool runs
+# at most `limit` requests at once and parks up to `queue` more; anything
+# beyond that, or waiting longer than `timeout`, is answered at once with
+# 503 and Retry-After instead of piling up behind the running ones.
+# waiters are served by priority (lower first), and within a priority
+# round-robin across booths so one busy booth cannot starve the others.
+# VOTE_LIMIT_<POOL>=limit:queue:timeout overrides the defaults
+DEFAULTS = {
+    'verify': (4, 16, 10.0),
+    'capture': (1, 4, 30.0),
+}
+RETRY_AFTER = int(os.environ.get('VOTE_RETRY_AFTER', '5'))
+
+
+class _Waiter(object):
+    __slots__ = ('event', 'granted')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class Pool(object):
+
+    def __init__(self, name, limit, queue, timeout):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        # priority -> booth -> waiters, booths kept in round-robin order
+        self._waiters = {}
+        self._publish()
+
+    def _publish(self):
+        appMetrics.gauge('admission_active', self._active, pool=self.name)
+        appMetrics.gauge('admission_queued', self._queued, pool=self.name)
+
+    def saturated(self):
+        """True once the wait queue is full, new work would be rejected."""
+        with self._lock:
+            return self._active >= self.limit and self._queued >= self.queue
+
+    def acquire(self, booth='', priority=0):
+        """Returns True when admitted, False when rejected (the caller sheds)."""
+        with self._lock:
+            if self._active < self.limit and not self._queued:
+                self._active += 1
+                self._publish()
+                appMetrics.inc('admission_admitted_total', pool=self.name)
+                return True
+            if self._queued >= self.queue:
+                appMetrics.inc('admission_rejected_total', pool=self.name, reason='queue_full')
+                return False
+            waiter = _Waiter()
+            booths = self._waiters.setdefault(priority, OrderedDict())
+            booths.setdefault(booth, deque()).append(waiter)
+            self._queued += 1
+            self._publish()
+        start = time.perf_counter()
+        waiter.event.wait(self.timeout)
+        with self._lock:
+            if not waiter.granted:
+                booths[booth].remove(waiter)
+                if not booths[booth]:
+                    del booths[booth]
+                self._queued -= 1
+                self._publish()
+                appMetrics.inc('admission_rejected_total', pool=self.name, reason='timeout')
+                return False
+        appMetrics.observe('admission_wait_seconds', time.perf_counter() - start, pool=self.name)
+        appMetrics.inc('admission_admitted_total', pool=self.name)
+        return True
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+            waiter = self._next()
+            if waiter is not None:
+                # the slot passes straight to the waiter
+                waiter.granted = True
+                self._queued -= 1
+                self._active += 1
+                waiter.event.set()
+            self._publish()
+
+    def _next(self):
+        for priority in sorted(self._waiters):
+            booths = self._waiters[priority]
+            if not booths:
+                continue
+            booth, waiters = next(iter(booths.items()))
+            waiter = waiters.popleft()
+            del booths[booth]
+            if waiters:
+                booths[booth] = waiters
+            return waiter
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {'active': self._active, 'queued': self._queued,
+                    'limit': self.limit, 'queue': self.queue}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool(name):
+    with _pools_lock:
+        if name not in _pools:
+            limit, queue, timeout = DEFAULTS.get(name, DEFAULTS['verify'])
+            conf = os.environ.get('VOTE_LIMIT_' + name.upper())
+            if conf:
+                parts = conf.split(':')
+                limit = int(parts[0])
+                queue = int(parts[1]) if len(parts) > 1 else queue
+                timeout = float(parts[2]) if len(parts) > 2 else timeout
+            _pools[name] = Pool(name, limit, queue, timeout)
+        return _pools[name]
+
+
+def busy():
+    from flask import Response
+    return Response('Server busy, please retry shortly', status=503,
+                    headers={'Retry-After': str(RETRY_AFTER)})
+
+
+def limited(name, booth, priority=lambda: 0):
+    """Decorator for a Flask view: run it inside pool `name`, 503 when shed.
+
+    booth() and priority() are evaluated per request."""
+    def decorate(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            p = pool(name)
+            if not p.acquire(booth(), priority()):
+                log.info("shedding %s request, pool %s saturated", view.__name__, name)
+                return busy()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                p.release()
+        return wrapper
+    return decorate
@@ -0,0 +1,149 @@
+import bisect
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# request/db/crypto timings kept in process and served by /metrics in the
+# Prometheus text format
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def gauge(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            # one slot per bucket, +Inf, then the sum
+            h = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        h[bisect.bisect_left(BUCKETS, seconds)] += 1
+        h[-1] += seconds
+
+
+@contextmanager
+def timed(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def _labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in items) + '}'
+
+
+def render():
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        histograms = sorted((k, list(v)) for k, v in _histograms.items())
+    lines, typed = [], set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE %s counter' % name)
+        lines.append('%s%s %s' % (name, _labels(labels), value))
+    for (name, labels), value in gauges:
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE %s gauge' % name)
+        lines.append('%s%s %s' % (name, _labels(labels), value))
+    for (name, labels), h in histograms:
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE %s histogram' % name)
+        total = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), h[:-1]):
+            total += count
+            lines.append('%s_bucket%s %d' % (name, _labels(labels, [('le', bound)]), total))
+        lines.append('%s_sum%s %.6f' % (name, _labels(labels), h[-1]))
+        lines.append('%s_count%s %d' % (name, _labels(labels), total))
+    return '\n'.join(lines) + '\n'
+
+
+class _Cursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, operation, params=None, **kwargs):
+        with timed('db_query_seconds', statement=operation.split(None, 1)[0].lower()):
+            return self._cursor.execute(operation, params, **kwargs)
+
+    def executemany(self, operation, seq_params):
+        with timed('db_query_seconds', statement=operation.split(None, 1)[0].lower()):
+            return self._cursor.executemany(operation, seq_params)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _Connection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return _Cursor(self._conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def instrument(conn):
+    """Wrap a DB-API connection so every query is timed."""
+    inc('db_connections_total')
+    return _Connection(conn)
+
+
+class SampleFilter(logging.Filter):
+    """Pass warnings and above, and only a sampled fraction of lower records."""
+
+    def __init__(self, rate):
+        logging.Filter.__init__(self)
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+def getLogger(name='vote'):
+    """Logger set up from VOTE_LOG_LEVEL (DEBUG..CRITICAL or OFF) and VOTE_LOG_SAMPLE (0..1)."""
+    log = logging.getLogger(name)
+    if not log.handlers:
+        level = os.environ.get('VOTE_LOG_LEVEL', 'INFO').upper()
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        handler.addFilter(SampleFilter(float(os.environ.get('VOTE_LOG_SAMPLE', '1'))))
+        log.addHandler(handler)
+        log.setLevel(logging.CRITICAL + 1 if level == 'OFF' else level)
+        log.propagate = False
+    return log
@@ -0,0 +1,148 @@
+import importlib
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import appMetrics
+
+log = appMetrics.getLogger()
+
+# the heavy stacks App.py needs are loaded on first use instead of at
+# import, so a worker only pays for what its role serves:
+#   VOTE_ROLE=admin   registration, candidates, results; never warms vision
+#   VOTE_ROLE=verify  the voter flow; warms vision, crypto and face at start
+#   VOTE_ROLE=all     (default) both, warmed at start
+# /ready answers 200 once the role's subsystems are loaded
+ROLE = os.environ.get('VOTE_ROLE', 'all')
+ROLES = {
+    'admin': ('db',),
+    'verify': ('db', 'vision', 'crypto', 'face'),
+    'all': ('db', 'vision', 'crypto', 'face'),
+}
+
+
+def _vision():
+    cv2 = importlib.import_module('cv2')
+    metrics = importlib.import_module('skimage.metrics')
+    return cv2, metrics.structural_similarity
+
+
+def _crypto():
+    ecies = importlib.import_module('ecies')
+    utils = importlib.import_module('ecies.utils')
+    return utils.generate_key, ecies.encrypt, ecies.decrypt
+
+
+def _face():
+    # FaceSDK activation plus the tracker's template cache
+    import voterFaceIndex
+    sdk = voterFaceIndex.facesdk()
+    if os.path.exists(voterFaceIndex.trackerMemoryFile):
+        voterFaceIndex.profile_templates(None)
+    return sdk
+
+
+def _db():
+    return importlib.import_module('mysql.connector')
+
+
+LOADERS = {'db': _db, 'vision': _vision, 'crypto': _crypto, 'face': _face}
+
+
+class Subsystem(object):
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.value = None
+        self.state = 'cold'
+        self.seconds = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self.state == 'ready':
+            return self.value
+        with self._lock:
+            if self.state != 'ready':
+                if ROLE == 'admin' and self.name not in ROLES['admin']:
+                    log.warning("admin worker loading %s on demand", self.name)
+                self.state = 'loading'
+                start = time.perf_counter()
+                try:
+                    self.value = self.loader()
+                except Exception as e:
+                    self.state, self.error = 'failed', str(e)
+                    raise
+                self.seconds = time.perf_counter() - start
+                self.state = 'ready'
+                appMetrics.observe('subsystem_load_seconds', self.seconds, subsystem=self.name)
+                log.info("%s loaded in %.2fs", self.name, self.seconds)
+        return self.value
+
+
+_subsystems = dict((name, Subsystem(name, loader)) for name, loader in LOADERS.items())
+
+
+def get(name):
+    return _subsystems[name].get()
+
+
+def warm(role=ROLE):
+    """Loads the role's subsystems in the background."""
+    def run():
+        for name in ROLES.get(role, ()):
+            try:
+                get(name)
+            except Exception:
+                log.warning("warm-up of %s failed", name, exc_info=True)
+    t = threading.Thread(target=run, name='warmup')
+    t.daemon = True
+    t.start()
+    return t
+
+
+def status(role=ROLE):
+    """(ready, {subsystem: state}) for the subsystems the role needs"""
+    states = {}
+    for name in ROLES.get(role, ()):
+        s = _subsystems[name]
+        states[name] = {'state': s.state}
+        if s.seconds is not None:
+            states[name]['seconds'] = round(s.seconds, 3)
+        if s.error:
+            states[name]['error'] = s.error
+    return all(v['state'] == 'ready' for v in states.values()), states
+
+
+_PROBE = """
+import resource, sys, time, json
+start = time.perf_counter()
+import appWarmup
+failed = {}
+for name in appWarmup.ROLES[sys.argv[1]]:
+    try:
+        appWarmup.get(name)
+    except Exception as e:
+        failed[name] = str(e)
+print(json.dumps({'seconds': time.perf_counter() - start,
+                  'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 'failed': failed}))
+"""
+
+
+def benchmark(roles=('admin', 'verify')):
+    """cold-start time and peak RSS of a fresh worker per role"""
+    import json
+    here = os.path.dirname(os.path.abspath(__file__))
+    for role in roles:
+        out = subprocess.run([sys.executable, '-c', _PROBE, role], cwd=here, capture_output=True, text=True,
+                             env=dict(os.environ, VOTE_LOG_LEVEL='OFF'))
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        print("%-7s %6.2fs %7.1f MB%s" % (role, r['seconds'], r['rss_mb'],
+                                          '  unavailable: ' + ', '.join(sorted(r['failed'])) if r['failed'] else ''))
+
+
+if __name__ == '__main__':
+    benchmark(tuple(sys.argv[1:]) or ('admin', 'verify'))
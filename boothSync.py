@@ -0,0 +1,328 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import appMetrics
+import voteTally
+import voteTurnout
+
+log = appMetrics.getLogger()
+
+# offline-capable booth mode: the voter flow runs against a local SQLite
+# replica of this booth's slice of regtb/cantb/facetb, votes are recorded
+# in the local boothvotes journal and pushed to the central votedtb in
+# batches. enabled by VOTE_BOOTH_DB (the replica file) and VOTE_BOOTH_ID.
+# the encrypted finger images referenced by regtb.FImage have to be copied
+# into the booth's blob directory along with the replica
+BOOTH_DB = os.environ.get('VOTE_BOOTH_DB', '')
+BOOTH_ID = os.environ.get('VOTE_BOOTH_ID', '')
+SYNC_BATCH = int(os.environ.get('VOTE_BOOTH_BATCH', '500'))
+SYNC_INTERVAL = float(os.environ.get('VOTE_BOOTH_SYNC', '30'))
+
+# the column types follow the MySQL ones: an untyped column keeps the
+# integer ids copied from MySQL as integers and id='3' never matches them
+REPLICATED = {
+    'regtb': "CREATE TABLE IF NOT EXISTS regtb (UserName TEXT, FatherName TEXT, Gender TEXT, Age TEXT, Email TEXT,"
+             " Phone TEXT, Address TEXT, VoterId TEXT PRIMARY KEY, AadharId TEXT, FImage TEXT, Pukey TEXT, PvKey TEXT)",
+    'cantb': "CREATE TABLE IF NOT EXISTS cantb (id INTEGER PRIMARY KEY, Name TEXT, PartName TEXT, PartCode TEXT,"
+             " Image TEXT, Address TEXT)",
+    'facetb': "CREATE TABLE IF NOT EXISTS facetb (VoterId TEXT PRIMARY KEY, ProfileId INTEGER)",
+}
+SCHEMA = ';\n'.join(REPLICATED.values()) + """;
+CREATE TABLE IF NOT EXISTS temptb (id INTEGER, UserName TEXT, Status TEXT);
+CREATE TABLE IF NOT EXISTS boothvotes (Seq INTEGER PRIMARY KEY AUTOINCREMENT, VoterId TEXT UNIQUE, PartCode TEXT,
+    Image TEXT, Constituency TEXT, CastAt REAL, Status TEXT DEFAULT 'pending');
+CREATE INDEX IF NOT EXISTS boothvotes_status ON boothvotes (Status, Seq);
+CREATE TABLE IF NOT EXISTS replicainfo (Name PRIMARY KEY, Value);
+-- uvote's duplicate check reads votedtb; at the booth that is the journal
+CREATE VIEW IF NOT EXISTS votedtb AS SELECT Seq AS id, VoterId, PartCode, Image, 1 AS count,
+    '' AS Hash1, '' AS Hash2, Constituency FROM boothvotes WHERE Status != 'conflict';
+"""
+
+
+def enabled():
+    return bool(BOOTH_DB)
+
+
+class _Cursor(object):
+    # the app's parameterised queries use the MySQL %s placeholder
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, operation, params=()):
+        return self._cursor.execute(operation.replace('%s', '?'), params or ())
+
+    def executemany(self, operation, seq_params):
+        return self._cursor.executemany(operation.replace('%s', '?'), seq_params)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _Connection(object):
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return _Cursor(self._conn.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def connect(filename=None):
+    """Connection to the booth replica, usable where the flow expects MySQL."""
+    conn = sqlite3.connect(filename or BOOTH_DB, timeout=30)
+    # a vote is acknowledged once its boothvotes row is committed
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")
+    return _Connection(conn)
+
+
+def init(filename=None):
+    conn = connect(filename)
+    conn.executescript(SCHEMA)
+    conn.commit()
+    conn.close()
+
+
+def replicate(central_connect, constituency, filename=None):
+    """Refreshes the booth replica with the voters and candidates of one constituency."""
+    init(filename)
+    central = central_connect()
+    local = connect(filename)
+    try:
+        cursor = central.cursor()
+        counts = {}
+        for table, where in (('regtb', "Address=%s"), ('cantb', "Address=%s"),
+                             ('facetb', "VoterId in (SELECT VoterId FROM regtb where Address=%s)")):
+            cursor.execute("SELECT * FROM " + table + " where " + where, (constituency,))
+            rows = cursor.fetchall()
+            # recreated rather than emptied, so booth files made before the
+            # column types were declared pick them up
+            local.execute("DROP TABLE " + table)
+            local.execute(REPLICATED[table])
+            if rows:
+                local.executemany("INSERT INTO " + table + " values (" + ','.join('?' * len(rows[0])) + ")", rows)
+            counts[table] = len(rows)
+        local.execute("REPLACE INTO replicainfo values ('constituency', ?)", (constituency,))
+        local.execute("REPLACE INTO replicainfo values ('replicated', ?)", (time.time(),))
+        local.commit()
+        log.info("booth replica of %s: %s", constituency, counts)
+        return counts
+    finally:
+        central.close()
+        local.close()
+
+
+def record(conn, vid, part, image, constituency):
+    """Journals a vote at the booth; False when the voter already voted here."""
+    try:
+        conn.execute("INSERT INTO boothvotes (VoterId, PartCode, Image, Constituency, CastAt) values (?, ?, ?, ?, ?)",
+                     (vid, part, image, constituency, time.time()))
+        conn.commit()
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return False
+    appMetrics.inc('booth_votes_total')
+    return True
+
+
+def _watermark(central, booth):
+    # last booth Seq the central database has taken, locked for this sync
+    cursor = central.cursor()
+    cursor.execute("SELECT Seq FROM synctb where Booth=%s for update", (booth,))
+    row = cursor.fetchone()
+    if row is None:
+        central.commit()
+        cursor.execute("INSERT IGNORE INTO synctb (Booth, Seq) values (%s, 0)", (booth,))
+        central.commit()
+        cursor.execute("SELECT Seq FROM synctb where Booth=%s for update", (booth,))
+        row = cursor.fetchone()
+    return row[0]
+
+
+def sync(central_connect, booth=None, filename=None, batch=SYNC_BATCH, sign=None):
+    """Pushes pending booth votes to the central votedtb.
+
+    A vote whose VoterId is already in votedtb (voted at another booth) is
+    not inserted but recorded in conflicttb and marked 'conflict' locally.
+    The booth's watermark in synctb moves in the same transaction as the
+    inserts, so an interrupted sync is simply repeated. Returns
+    (synced, conflicts)."""
+    booth = booth or BOOTH_ID
+    sign = sign or _sign
+    local = connect(filename)
+    synced = conflicts = 0
+    reseeded = False
+    try:
+        while True:
+            # chaintb rows are created before the watermark and chains are locked
+            voteTally.ensure_chains(central_connect, [r[0] for r in local.execute(
+                "SELECT distinct Constituency FROM boothvotes where Status='pending'")])
+            central = central_connect()
+            try:
+                hw = _watermark(central, booth)
+                _settle(local, central, booth, hw)
+                rows = local.execute("SELECT Seq, VoterId, PartCode, Image, Constituency, CastAt FROM boothvotes"
+                                     " where Seq>? order by Seq limit ?", (hw, batch)).fetchall()
+                if not rows:
+                    central.commit()
+                    break
+                try:
+                    with appMetrics.timed('booth_sync_seconds'):
+                        clash = _push(central, booth, rows, sign)
+                        central.commit()
+                except LookupError:
+                    # an archive purge removed a chain row after it was seeded:
+                    # roll back and repeat the batch, which seeds it again
+                    central.rollback()
+                    if reseeded:
+                        raise
+                    reseeded = True
+                    continue
+            finally:
+                central.close()
+            _mark(local, rows, clash)
+            synced += len(rows) - len(clash)
+            conflicts += len(clash)
+            if len(rows) < batch:
+                break
+    finally:
+        local.close()
+    if conflicts:
+        log.warning("booth %s: %d votes conflict with votes cast elsewhere", booth, conflicts)
+    return synced, conflicts
+
+
+def _push(central, booth, rows, sign):
+    # the chains are locked before the VoterId check, as in uvote
+    tips = {}
+    for const in sorted(set(r[4] for r in rows)):
+        tips[const] = voteTally.chain_tip(central, const)
+    cursor = central.cursor()
+    cursor.execute("SELECT VoterId FROM votedtb where VoterId in (" + ','.join(['%s'] * len(rows)) + ") for update",
+                   [r[1] for r in rows])
+    existing = set(r[0] for r in cursor.fetchall())
+    clash = set()
+    fresh = []
+    for r in rows:
+        if r[1] in existing:
+            clash.add(r[0])
+        else:
+            existing.add(r[1])
+            fresh.append(r)
+    values = []
+    turnout = {}
+    for seq, vid, part, image, const, cast_at in fresh:
+        hash2 = sign()
+        values.append((vid, part, image, tips[const], hash2, const, cast_at))
+        tips[const] = hash2
+        # turnout by the time the vote was cast at the booth, not synced
+        key = (const, voteTurnout.bucket(cast_at))
+        turnout[key] = turnout.get(key, 0) + 1
+    cursor = central.cursor()
+    if values:
+        cursor.executemany("insert into votedtb (VoterId, PartCode, Image, count, Hash1, Hash2, Constituency, CastTime)"
+                           " values (%s, %s, %s, '1', %s, %s, %s, FROM_UNIXTIME(%s))", values)
+    for const, tip in tips.items():
+        voteTally.advance(central, const, tip)
+    voteTurnout.record(central, turnout)
+    if clash:
+        cursor.executemany("insert into conflicttb (Booth, Seq, VoterId, PartCode, Constituency) values (%s, %s, %s, %s, %s)",
+                           [(booth, r[0], r[1], r[2], r[4]) for r in rows if r[0] in clash])
+    cursor.execute("UPDATE synctb set Seq=%s where Booth=%s", (rows[-1][0], booth))
+    appMetrics.inc('booth_synced_total', len(values))
+    appMetrics.inc('booth_conflicts_total', len(clash))
+    return clash
+
+
+def _mark(local, rows, clash):
+    local.executemany("UPDATE boothvotes set Status=? where Seq=?",
+                      [('conflict' if r[0] in clash else 'synced', r[0]) for r in rows])
+    local.commit()
+
+
+def _settle(local, central, booth, hw):
+    # votes the central side took in a sync whose local bookkeeping was lost
+    rows = local.execute("SELECT Seq FROM boothvotes where Status='pending' and Seq<=?", (hw,)).fetchall()
+    if not rows:
+        return
+    cursor = central.cursor()
+    cursor.execute("SELECT Seq FROM conflicttb where Booth=%s and Seq<=%s", (booth, hw))
+    clash = set(r[0] for r in cursor.fetchall())
+    _mark(local, rows, clash)
+
+
+def pending(filename=None):
+    conn = connect(filename)
+    try:
+        return conn.execute("SELECT count(*) FROM boothvotes where Status='pending'").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _sign():
+    import hmac
+    import hashlib
+    import random
+    key = bytes.fromhex("E49756B4C8FAB4E48222A3E7F3B97CC3")
+    return hmac.new(key, str(random.randrange(1111, 9999)).encode(), hashlib.sha256).hexdigest().upper()
+
+
+def start(central_connect, sign=None):
+    """Background sync every VOTE_BOOTH_SYNC seconds; failures (link down) are retried."""
+    def loop():
+        while True:
+            try:
+                sync(central_connect, sign=sign)
+            except Exception:
+                log.warning("booth sync failed, %d votes pending", pending(), exc_info=True)
+            time.sleep(SYNC_INTERVAL)
+    t = threading.Thread(target=loop, name='booth-sync')
+    t.daemon = True
+    t.start()
+    return t
+
+
+def benchmark(central_connect, votes=5000, batches=(1, 50, 500)):
+    """sync throughput into a stand-in central database for several batch sizes"""
+    for batch in batches:
+        filename = 'bench-booth.db'
+        for f in (filename, filename + '-wal', filename + '-shm'):
+            if os.path.exists(f):
+                os.remove(f)
+        init(filename)
+        booth = 'bench-%d-%d' % (batch, int(time.time()))
+        local = connect(filename)
+        for i in range(votes):
+            record(local, '%s-%d' % (booth, i), 'P%d' % (i % 4), 'p.png', 'BENCH%d' % (i % 8))
+        local.close()
+        start = time.time()
+        synced, conflicts = sync(central_connect, booth, filename, batch)
+        t = time.time() - start
+        print("batch=%-5d %8.1f votes/s  synced=%d conflicts=%d" % (batch, synced / t, synced, conflicts))
+
+
+if __name__ == '__main__':
+    # python boothSync.py replicate <constituency> | sync | bench [votes]
+    import mysql.connector
+
+    def central():
+        return mysql.connector.connect(user='root', password='', host=os.environ.get('VOTE_CENTRAL_HOST', 'localhost'),
+                                       database=os.environ.get('VOTE_CENTRAL_DB', '3facefingervoteencdb'))
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else 'sync'
+    if cmd == 'replicate':
+        replicate(central, sys.argv[2])
+    elif cmd == 'sync':
+        print("synced %d, conflicts %d" % sync(central))
+    elif cmd == 'bench':
+        benchmark(central, *[int(a) for a in sys.argv[2:3]])
@@ -0,0 +1,188 @@
+import gzip
+import hashlib
+import importlib
+import mimetypes
+import os
+import re
+import shutil
+import sys
+
+import appMetrics
+
+log = appMetrics.getLogger()
+
+# candidate (party) images are stored under a name derived from their
+# content, together with a fixed-size ballot thumbnail as JPEG and WebP:
+#   <hash>.<ext>   the original
+#   <hash>-t.jpg   THUMB_SIZE thumbnail
+#   <hash>-t.webp  the same thumbnail as WebP
+# a content-hashed name never changes meaning, so it is served with a
+# year-long immutable Cache-Control; everything else in static/ gets
+# revalidated through its ETag and, if precompress() was run, a .gz twin
+THUMB_SIZE = int(os.environ.get('VOTE_THUMB_SIZE', '160'))
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=300'
+HASHED = re.compile(r'^[0-9a-f]{16}(-t)?\.[a-z0-9]+$')
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.json', '.txt')
+
+_thumbs = {}
+
+
+def _cv2():
+    return importlib.import_module('cv2')
+
+
+def content_name(data, filename):
+    ext = os.path.splitext(filename)[1].lower() or '.jpg'
+    return hashlib.sha256(data).hexdigest()[:16] + ext
+
+
+def thumbnail_names(name):
+    base = os.path.splitext(name)[0]
+    return base + '-t.jpg', base + '-t.webp'
+
+
+def make_thumbnails(path, size=THUMB_SIZE):
+    """Writes the JPEG and WebP thumbnails next to an original; False when it is not an image."""
+    cv2 = _cv2()
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        return False
+    h, w = img.shape[:2]
+    scale = float(size) / max(h, w)
+    if scale < 1:
+        img = cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    folder, name = os.path.split(path)
+    jpg, webp = thumbnail_names(name)
+    cv2.imwrite(os.path.join(folder, jpg), img, [cv2.IMWRITE_JPEG_QUALITY, 82, cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+    cv2.imwrite(os.path.join(folder, webp), img, [cv2.IMWRITE_WEBP_QUALITY, 80])
+    return True
+
+
+def save(upload, folder):
+    """Stores an uploaded file (werkzeug FileStorage) and its thumbnails; returns the stored name."""
+    data = upload.read()
+    name = content_name(data, upload.filename or '')
+    path = os.path.join(folder, name)
+    if not os.path.exists(path):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    try:
+        if not make_thumbnails(path):
+            log.warning("candidate image %s could not be decoded, no thumbnails", name)
+    except ImportError:
+        log.warning("cv2 not available, candidate image %s kept without thumbnails", name)
+    return name
+
+
+def thumbnail(folder, name, webp=False):
+    """Name of the ballot thumbnail of an image, the image itself when there is none."""
+    jpg, wp = thumbnail_names(name)
+    thumb = wp if webp else jpg
+    key = (folder, thumb)
+    # only hits are cached: a thumbnail made later by migrate or another
+    # worker is picked up on the next ballot
+    if key not in _thumbs and os.path.exists(os.path.join(folder, thumb)):
+        _thumbs[key] = True
+    return thumb if key in _thumbs else name
+
+
+def ballot(rows, folder, webp=False, column=4):
+    """cantb rows with the Image column pointing at the thumbnails."""
+    return [row[:column] + (thumbnail(folder, row[column], webp),) + row[column + 1:] for row in rows]
+
+
+def cache_control(filename):
+    return IMMUTABLE if HASHED.match(os.path.basename(filename)) else REVALIDATE
+
+
+def send(folder, filename):
+    """Flask response for a static file: .gz twin when the client accepts gzip, cache headers, ETag."""
+    from flask import request, send_from_directory
+    gz = os.path.join(folder, filename + '.gz')
+    if 'gzip' in request.headers.get('Accept-Encoding', '') and os.path.isfile(gz):
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_from_directory(folder, filename + '.gz', mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_from_directory(folder, filename)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = cache_control(filename)
+    return response
+
+
+def precompress(root):
+    """Writes a gzip -9 twin of every compressible static file that changed."""
+    written = 0
+    for folder, dirs, files in os.walk(root):
+        for name in files:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            path = os.path.join(folder, name)
+            gz = path + '.gz'
+            if os.path.exists(gz) and os.path.getmtime(gz) >= os.path.getmtime(path):
+                continue
+            with open(path, 'rb') as src, gzip.open(gz + '.tmp', 'wb', 9) as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(gz + '.tmp', gz)
+            written += 1
+    return written
+
+
+def migrate(connect, folder):
+    """Renames the existing cantb images to content names and builds their thumbnails.
+
+    The old files are removed once cantb points at the new names."""
+    conn = connect()
+    old = set()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, Image FROM cantb")
+        for cid, image in cursor.fetchall():
+            path = os.path.join(folder, image)
+            if HASHED.match(image) or not os.path.isfile(path):
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            name = content_name(data, image)
+            shutil.copyfile(path, os.path.join(folder, name))
+            make_thumbnails(os.path.join(folder, name))
+            cursor.execute("UPDATE cantb set Image=%s where id=%s", (name, cid))
+            old.add(path)
+        conn.commit()
+    finally:
+        conn.close()
+    for path in old:
+        os.remove(path)
+
+
+def measure(folder, candidates=None, mbps=4.0):
+    """Ballot image payload with the originals against the thumbnails."""
+    names = candidates or sorted(n for n in os.listdir(folder) if HASHED.match(n) and '-t.' not in n)
+    sizes = {'original': 0, 'jpeg thumbnail': 0, 'webp thumbnail': 0}
+    for name in names:
+        jpg, webp = thumbnail_names(name)
+        sizes['original'] += os.path.getsize(os.path.join(folder, name))
+        for label, thumb in (('jpeg thumbnail', jpg), ('webp thumbnail', webp)):
+            p = os.path.join(folder, thumb)
+            sizes[label] += os.path.getsize(p if os.path.exists(p) else os.path.join(folder, name))
+    print("%d candidate images" % len(names))
+    for label, size in sizes.items():
+        # transfer time of one ballot's images at the given link speed
+        print("%-15s %10d bytes  %7.0f ms at %.0f Mbit/s" % (label, size, size * 8 / (mbps * 1e6) * 1000, mbps))
+    return sizes
+
+
+if __name__ == '__main__':
+    # python candidateImages.py precompress <static dir> | migrate <upload dir> | measure <upload dir>
+    cmd, folder = sys.argv[1], sys.argv[2]
+    if cmd == 'precompress':
+        print("%d files compressed" % precompress(folder))
+    elif cmd == 'migrate':
+        import mysql.connector
+        migrate(lambda: mysql.connector.connect(user='root', password='', host=os.environ.get('VOTE_DB_HOST', 'localhost'),
+                                                database='3facefingervoteencdb'), folder)
+    elif cmd == 'measure':
+        measure(folder)
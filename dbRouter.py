@@ -0,0 +1,180 @@
+import itertools
+import os
+import sys
+import threading
+import time
+
+import appMetrics
+import appWarmup
+
+log = appMetrics.getLogger()
+
+# read/write split. writes and the voter flow use the primary
+# (VOTE_DB_HOST); admin and reporting reads ask for readonly=True and go
+# to one of VOTE_DB_REPLICAS ("host[:port],..."), round-robin, as long as
+# that replica is no more than VOTE_REPLICA_MAX_LAG seconds behind (-1
+# trusts replicas without checking). a session that committed a write reads
+# from the primary for the same number of seconds afterwards, so an admin
+# sees their own changes. replicas that lag, stop replicating or refuse
+# connections are skipped until their next check
+PRIMARY = os.environ.get('VOTE_DB_HOST', 'localhost')
+REPLICAS = [h.strip() for h in os.environ.get('VOTE_DB_REPLICAS', '').split(',') if h.strip()]
+MAX_LAG = float(os.environ.get('VOTE_REPLICA_MAX_LAG', '5'))
+CHECK_INTERVAL = 2.0
+# a replica that hangs is given up on after this long
+PROBE_TIMEOUT = 1
+DATABASE = '3facefingervoteencdb'
+
+
+def _open(host, **kwargs):
+    mysql = appWarmup.get('db')
+    name, _, port = host.partition(':')
+    return mysql.connect(user='root', password='', host=name, port=int(port or 3306), database=DATABASE, **kwargs)
+
+
+class _Primary(object):
+    # remembers in the Flask session when it last committed
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def commit(self):
+        self._conn.commit()
+        _wrote()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def _wrote():
+    from flask import has_request_context, session
+    if has_request_context():
+        session['dbw'] = time.time()
+
+
+def _recent_write():
+    from flask import has_request_context, session
+    return has_request_context() and time.time() - session.get('dbw', 0) < max(MAX_LAG, CHECK_INTERVAL)
+
+
+class Replica(object):
+
+    def __init__(self, host):
+        self.host = host
+        self.lag = None
+        self.checked = 0
+        self.healthy = False
+        self._checking = False
+        self._lock = threading.Lock()
+
+    def _check(self):
+        conn = _open(self.host, connection_timeout=PROBE_TIMEOUT)
+        try:
+            if MAX_LAG < 0:
+                return 0
+            cursor = conn.cursor(dictionary=True)
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except Exception:
+                # MySQL before 8.0.22
+                cursor.execute("SHOW SLAVE STATUS")
+            row = cursor.fetchone()
+            cursor.fetchall()
+            if not row:
+                return None
+            lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+            return None if lag is None else float(lag)
+        finally:
+            conn.close()
+
+    def usable(self):
+        with self._lock:
+            due = not self._checking and time.time() - self.checked >= CHECK_INTERVAL
+            if due:
+                self._checking = True
+        if due:
+            # one reader probes, outside the lock; the others go by the
+            # last answer meanwhile
+            try:
+                lag = self._check()
+            except Exception as e:
+                log.warning("replica %s unreachable: %s", self.host, e)
+                lag = None
+            with self._lock:
+                self.lag = lag
+                self.healthy = lag is not None and (MAX_LAG < 0 or lag <= MAX_LAG)
+                self.checked = time.time()
+                self._checking = False
+            appMetrics.gauge('db_replica_lag_seconds', -1 if lag is None else lag, replica=self.host)
+        return self.healthy
+
+
+_replicas = [Replica(h) for h in REPLICAS]
+_next = itertools.cycle(range(len(_replicas))) if _replicas else None
+_next_lock = threading.Lock()
+
+
+def route(readonly):
+    """The host a connection goes to: a usable replica for readonly work, else the primary."""
+    if not readonly or not _replicas:
+        return PRIMARY
+    if _recent_write():
+        appMetrics.inc('db_route_total', target='primary', reason='read_your_writes')
+        return PRIMARY
+    for _ in range(len(_replicas)):
+        with _next_lock:
+            replica = _replicas[next(_next)]
+        if replica.usable():
+            appMetrics.inc('db_route_total', target='replica')
+            return replica.host
+    appMetrics.inc('db_route_total', target='primary', reason='no_replica')
+    return PRIMARY
+
+
+def connect(readonly=False):
+    host = route(readonly)
+    if host == PRIMARY:
+        return _Primary(_open(host)) if _replicas else _open(host)
+    try:
+        return _open(host)
+    except Exception:
+        log.warning("replica %s refused the connection, using the primary", host, exc_info=True)
+        for replica in _replicas:
+            if replica.host == host:
+                replica.healthy = False
+        return _Primary(_open(PRIMARY))
+
+
+def status():
+    return [{'host': r.host, 'lag': r.lag, 'healthy': r.healthy} for r in _replicas]
+
+
+if __name__ == '__main__':
+    # check against a primary and replica(s), e.g. two local instances:
+    #   VOTE_DB_HOST=127.0.0.1:3306 VOTE_DB_REPLICAS=127.0.0.1:3307 python dbRouter.py
+    print("primary %s" % PRIMARY)
+    for r in _replicas:
+        r.usable()
+        print("replica %-20s lag=%s usable=%s" % (r.host, r.lag, r.healthy))
+    conn = connect()
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE IF NOT EXISTS routetb (id int primary key, Stamp double)")
+    stamp = time.time()
+    cursor.execute("REPLACE INTO routetb values (1, %s)", (stamp,))
+    conn.commit()
+    conn.close()
+    start = time.time()
+    while True:
+        host = route(True)
+        conn = connect(True)
+        cursor = conn.cursor()
+        cursor.execute("SELECT Stamp FROM routetb where id=1")
+        row = cursor.fetchone()
+        conn.close()
+        if row and row[0] == stamp:
+            print("write visible on %s after %.3fs" % (host, time.time() - start))
+            break
+        if time.time() - start > 30:
+            print("write not visible on %s after 30s" % host)
+            sys.exit(1)
+        time.sleep(0.05)
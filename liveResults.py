@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+
+import appMetrics
+
+log = appMetrics.getLogger()
+
+# live results for the election-night dashboards. the vote-commit path
+# records each vote here; a ticker folds them into one delta per interval
+# and every observer streams the same deltas over Server-Sent Events, so
+# DB work is one full count at start and per resync no matter how many
+# observers are connected
+INTERVAL = float(os.environ.get('VOTE_RESULTS_INTERVAL', '1'))
+# periodic recount that also picks up votes committed by other processes
+RESYNC = float(os.environ.get('VOTE_RESULTS_RESYNC', '60'))
+HEARTBEAT = 15
+# deltas kept for observers that fell behind; further back gets a snapshot
+HISTORY = 64
+
+
+def sse(event, version, data):
+    return 'event: %s\nid: %d\ndata: %s\n\n' % (event, version, json.dumps(data, sort_keys=True))
+
+
+class Results(object):
+    """load() returns {constituency: {PartCode: votes}} from the database."""
+
+    def __init__(self, load, interval=INTERVAL, resync=RESYNC):
+        self.load = load
+        self.interval = interval
+        self.resync = resync
+        self._cond = threading.Condition()
+        self._pending = Counter()
+        self._totals = {}
+        self._version = 0
+        self._history = deque(maxlen=HISTORY)
+        self._thread = None
+        self._next_resync = 0
+        self._observers = 0
+
+    def record(self, constituency, party, n=1):
+        with self._cond:
+            self._pending[(constituency, party)] += n
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='live-results')
+            self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        # the first tick loads the totals; observers already connected get
+        # them as a snapshot, and a failed load is retried next interval
+        while True:
+            try:
+                self.tick()
+            except Exception:
+                log.warning("live results tick failed", exc_info=True)
+            time.sleep(self.interval)
+
+    def tick(self):
+        now = time.time()
+        if now >= self._next_resync:
+            with self._cond:
+                # votes recorded while the count runs may be counted twice
+                # until the next resync; the count itself is authoritative
+                self._pending.clear()
+            totals = dict((c, dict(v)) for c, v in self.load().items())
+            self._next_resync = now + self.resync
+            with self._cond:
+                self._totals = totals
+                self._version += 1
+                self._history.clear()
+                self._cond.notify_all()
+            appMetrics.inc('results_resync_total')
+            return
+        with self._cond:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, Counter()
+            delta = {}
+            for (constituency, party), n in pending.items():
+                delta.setdefault(constituency, {})[party] = n
+                votes = self._totals.setdefault(constituency, {})
+                votes[party] = votes.get(party, 0) + n
+            self._version += 1
+            self._history.append((self._version, {'votes': delta, 'total': self._total()}))
+            self._cond.notify_all()
+        appMetrics.inc('results_delta_total')
+
+    def _total(self):
+        return sum(sum(v.values()) for v in self._totals.values())
+
+    def _snapshot(self):
+        return sse('snapshot', self._version, {'votes': self._totals, 'total': self._total()})
+
+    def events(self, last_id=None):
+        """SSE stream: a snapshot (unless last_id is current), then deltas."""
+        self.start()
+        with self._cond:
+            self._observers += 1
+            appMetrics.gauge('results_observers', self._observers)
+            version = self._version
+            first = None if last_id == version else self._snapshot()
+        try:
+            if first:
+                yield first
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._version > version, HEARTBEAT)
+                    if self._version == version:
+                        out = ': keepalive\n\n'
+                    elif self._history and self._history[0][0] <= version + 1:
+                        out = ''.join(sse('delta', v, d) for v, d in self._history if v > version)
+                    else:
+                        out = self._snapshot()
+                    version = self._version
+                yield out
+        finally:
+            with self._cond:
+                self._observers -= 1
+                appMetrics.gauge('results_observers', self._observers)
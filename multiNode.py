@@ -0,0 +1,95 @@
+import sys
+import time
+from multiprocessing import Process
+
+import sessionStore
+import voteTally
+
+# multi-process check of the multi-node mode against the election database.
+# every process stands in for one App.py node: it picks up verification
+# contexts that another node created at login (sesstb), casts the votes
+# through the chaintb row lock and drops the contexts. afterwards every vote
+# must be present exactly once and every constituency chain must verify.
+# runs on scratch copies of the tables:
+#   python multiNode.py [votes] [constituencies] [nodes ...]
+TABLE = 'votedtb_mn'
+CHAIN = 'chaintb_mn'
+SESSIONS = 'sesstb_mn'
+
+
+def connect():
+    import mysql.connector
+    return mysql.connector.connect(user='root', password='', host='localhost',
+                                   database='3facefingervoteencdb')
+
+
+def sign():
+    import hmac
+    import hashlib
+    import random
+    key = bytes.fromhex("E49756B4C8FAB4E48222A3E7F3B97CC3")
+    return hmac.new(key, str(random.randrange(1111, 9999)).encode(), hashlib.sha256).hexdigest().upper()
+
+
+def setup(votes, constituencies):
+    conn = connect()
+    cursor = conn.cursor()
+    for table, like in ((TABLE, 'votedtb'), (CHAIN, 'chaintb'), (SESSIONS, 'sesstb')):
+        cursor.execute("DROP TABLE IF EXISTS " + table)
+        cursor.execute("CREATE TABLE " + table + " LIKE " + like)
+    conn.commit()
+    conn.close()
+    # the login node: one verified context per voter
+    store = sessionStore.DbStore(connect, SESSIONS)
+    for i in range(votes):
+        store.set('t%d' % i, {'vid': 'MN%d' % i, 'address': 'C%d' % (i % constituencies),
+                              'finger': True, 'face': True, 'otp': True})
+
+
+def node(n, nodes, votes):
+    store = sessionStore.DbStore(connect, SESSIONS)
+    for i in range(n, votes, nodes):
+        token = 't%d' % i
+        ctx = store.get(token)
+        if ctx is None:
+            raise RuntimeError('context %s not visible on node %d' % (token, n))
+        conn, tips = voteTally.lock_chains(connect, [ctx['address']], TABLE, CHAIN)
+        tip = tips[ctx['address']]
+        hash2 = sign()
+        conn.cursor().execute("insert into " + TABLE + " (VoterId, PartCode, Image, count, Hash1, Hash2, Constituency)"
+                              " values (%s, 'P', 'p.png', '1', %s, %s, %s)", (ctx['vid'], tip, hash2, ctx['address']))
+        voteTally.advance(conn, ctx['address'], hash2, CHAIN)
+        conn.commit()
+        conn.close()
+        store.delete(token)
+
+
+def run(nodes, votes, constituencies):
+    setup(votes, constituencies)
+    procs = [Process(target=node, args=(n, nodes, votes)) for n in range(nodes)]
+    start = time.time()
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    elapsed = time.time() - start
+    failed = [p.exitcode for p in procs if p.exitcode]
+
+    conn = connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT count(*), count(distinct VoterId) FROM " + TABLE)
+    total, distinct = cursor.fetchone()
+    conn.close()
+    broken = voteTally.verify(connect, table=TABLE)
+    ok = not failed and total == distinct == votes and not broken
+    print("nodes=%-3d %8.1f votes/s  votes=%d distinct=%d broken=%d %s"
+          % (nodes, votes / elapsed, total, distinct, len(broken), 'OK' if ok else 'FAIL'))
+    return ok
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:]]
+    votes = args[0] if args else 2000
+    constituencies = args[1] if len(args) > 1 else 8
+    ok = all([run(n, votes, constituencies) for n in (args[2:] or (1, 2, 4, 8))])
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+# server-side verification context for one voter's pass through the
+# login -> finger -> face -> otp -> vote flow. the browser session only
+# carries the token, the voter fields live here until the TTL runs out
+CONTEXT_TTL = int(os.environ.get('VOTE_CONTEXT_TTL', '900'))
+
+# the regtb fields the flow needs; they never change while a voter is
+# logged in so they are read once at login
+FIELDS = (('name', 0), ('email', 4), ('phone', 5), ('address', 6),
+          ('vid', 7), ('fimage', 9), ('pvkey', 11))
+
+STEPS = ('finger', 'face', 'otp')
+
+
+class MemoryStore(object):
+    """Dict with a per-entry expiry, shared by all request threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+        self._next_purge = 0
+
+    def get(self, key):
+        if key is None:
+            return None
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] < now:
+                del self._data[key]
+                return None
+            return dict(item[1])
+
+    def set(self, key, value, ttl=CONTEXT_TTL):
+        now = time.time()
+        with self._lock:
+            self._data[key] = (now + ttl, dict(value))
+            if now >= self._next_purge:
+                self._purge(now)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def _purge(self, now):
+        # abandoned logins would otherwise stay in memory forever
+        for key in [k for k, v in self._data.items() if v[0] < now]:
+            del self._data[key]
+        self._next_purge = now + 60
+
+
+class DbStore(object):
+    """The same interface on a database table, so that every App.py node
+    behind a load balancer sees the same contexts."""
+
+    def __init__(self, connect, table='sesstb'):
+        self.connect = connect
+        self.table = table
+        self._next_purge = 0
+
+    def get(self, key):
+        if key is None:
+            return None
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT Data FROM " + self.table + " where Token=%s and Expires>=%s",
+                           (key, int(time.time())))
+            row = cursor.fetchone()
+            return json.loads(row[0]) if row else None
+        finally:
+            conn.close()
+
+    def set(self, key, value, ttl=CONTEXT_TTL):
+        now = time.time()
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("REPLACE INTO " + self.table + " (Token, Data, Expires) values (%s, %s, %s)",
+                           (key, json.dumps(value), int(now + ttl)))
+            if now >= self._next_purge:
+                self._next_purge = now + 60
+                cursor.execute("DELETE FROM " + self.table + " where Expires<%s", (int(now),))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def delete(self, key):
+        conn = self.connect()
+        try:
+            conn.cursor().execute("DELETE FROM " + self.table + " where Token=%s", (key,))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+store = MemoryStore()
+
+
+def use_database(connect):
+    """Keeps the contexts in sesstb instead of this process (multi-node mode)."""
+    global store
+    store = DbStore(connect)
+
+
+def create(row):
+    """Builds the context from the regtb row and returns its token."""
+    ctx = dict((name, row[i]) for name, i in FIELDS)
+    for step in STEPS:
+        ctx[step] = False
+    token = uuid.uuid4().hex
+    store.set(token, ctx)
+    return token
+
+
+def load(token):
+    return store.get(token)
+
+
+def passed(token, step):
+    """Marks a verification step as passed and refreshes the TTL."""
+    ctx = store.get(token)
+    if ctx is None:
+        return None
+    ctx[step] = True
+    store.set(token, ctx)
+    return ctx
+
+
+def drop(token):
+    if token:
+        store.delete(token)
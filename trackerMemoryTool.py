@@ -10,10 +10,11 @@
 ###############################################################
 
 from __future__ import print_function
-import sys, struct, json, base64, os.path
+import sys, struct, json, base64, os.path, mmap, time, gc, hashlib, re
 
 FSDK_signature = 0x4b445346
 FSDK_template_size = 1040
+FSDK_features_size = 70*2*4
 
 read_data = lambda f, sig, n, s: struct.unpack(sig, f.read(s))[0] if n==1 else struct.unpack(sig*n, f.read(n*s))
 read_byte = lambda f, n=1: read_data(f, 'B', n, 1)
@@ -27,10 +28,102 @@ write_int = lambda f, *v: write_data(f, 'i', *v)
 write_long = lambda f, *v: write_data(f, 'q', *v) # qword: 64 bit OS long
 write_float = lambda f, *v: write_data(f, 'f', *v)
 
+# precompiled layouts for the mmap parser; '=' keeps native byte order without alignment, as read_data does
+int1_struct, int2_struct, int5_struct = struct.Struct('=i'), struct.Struct('=2i'), struct.Struct('=5i')
+long2_struct = struct.Struct('=2q')
+face_tail_struct = struct.Struct('=2qB') # frame_id, face_id, is cropped face present
+attribute_struct = struct.Struct('=2if')
+
+# merge compares fixed-size template digests instead of raw 1040-byte templates
+template_digest_size = 16
+template_digest = lambda template: hashlib.blake2b(template, digest_size = template_digest_size).digest()
+
 
 class FSDKTrackerDataError(Exception): pass
 
 
+class TrackerJSONEncoder(json.JSONEncoder):
+	def default(self, obj):
+		if hasattr(obj, 'json_fields'):
+			return {f: getattr(obj, f) for f in obj.json_fields if getattr(obj, f) is not None}
+		if type(obj) in (bytes, memoryview):
+			return base64.b64encode(obj).decode('utf-8')
+		return json.JSONEncoder.default(self, obj)
+
+
+def read_header(f, td):
+	""" read binary file fields preceding the faces into td, return the number of faces """
+	if read_int(f) != FSDK_signature:
+		raise FSDKTrackerDataError("Invalid file format")
+	td.version = read_int(f)
+	if td.version != 6:
+		raise FSDKTrackerDataError("Incorrect version of tracker data file: %i" % td.version)
+	td.frames_num, td.faces_num = read_long(f, 2)
+	read_profile = lambda : (read_int(f), f.read(read_int(f))[:-1].decode('utf-8')) # id, name
+	profiles = (read_profile() for p in range(read_int(f)))
+	td.profiles = dict(p for p in profiles if p[1])
+	return read_int(f)
+
+def read_trailer(f, td):
+	""" read binary file fields following the faces into td """
+	def __read_merge(f):
+		size = read_int(f)
+		name = f.read(size)[:-1].decode('utf-8')
+		n = read_int(f)//4
+		return dict(name=name, data=struct.unpack('=%ii' % n, f.read(n*4)))
+	td.max_id, td.max_seq_id = read_int(f, 2)
+	td.reassignments = [{'reassigned_id': read_int(f), 'new_id': read_int(f)} for r in range(read_int(f))]
+	td.merges = [__read_merge(f) for r in range(read_int(f))]
+	td.attributes = []
+	try:
+		for r in range(read_int(f)):
+			td.attributes.append({'id': read_int(f), 'attr_info1': read_int(f), 'attr_info2': read_float(f)})
+	except:
+		print("The file is corrupted: some face attributes were ignored")
+
+def write_header(f, td, profiles):
+	write_int(f, FSDK_signature, td.version)
+	write_long(f, td.frames_num, td.faces_num)
+	write_int(f, len(profiles))
+	for id, name in profiles.items():
+		write_int(f, id, len(name)+1)
+		f.write(name.encode())
+		write_byte(f, 0)
+
+def write_trailer(f, td):
+	write_int(f, td.max_id, td.max_seq_id)
+	write_int(f, len(td.reassignments))
+	for r in td.reassignments:
+		write_int(f, r['reassigned_id'], r['new_id'])
+	write_int(f, len(td.merges))
+	for m in td.merges:
+		write_int(f, len(m['name'])+1)
+		f.write(m['name'].encode())
+		write_byte(f, 0)
+		write_int(f, len(m['data'])*4, *m['data'])
+	write_int(f, len(td.attributes))
+	for m in td.attributes:
+		write_int(f, m['id'], m['attr_info1'])
+		write_float(f, m['attr_info2'])
+
+def reassignment_map(reassignments):
+	return {r['reassigned_id'] : r['new_id'] for r in reassignments if r['reassigned_id'] != r['new_id']}
+
+def statistics_info(td, faces_num, images_num, profiles_num):
+	if faces_num:
+		finfo = "{cnt} (with images: {n})".format(cnt = faces_num,
+			n = 'all' if images_num == faces_num else images_num)
+	else:
+		finfo = "{}".format(faces_num)
+	stat_info = "file version: {v}\nframesNum: {fr}\nfacesNum: {fa}\nprofiles: {pr}\nfaces: {faces}\n"\
+		"max_id: {maxid}\nmax seq id: {mseqid}\nreassignments: {reas}\nmerges: {mgs}\nattributes: {attrs}".format(
+			v = td.version, fr = td.frames_num, fa = td.faces_num, pr = profiles_num,
+			faces = finfo, maxid = td.max_id, mseqid = td.max_seq_id,
+			reas = len(td.reassignments), mgs = len(td.merges), attrs = len(td.attributes)
+		)
+	return stat_info
+
+
 class TrackerData:
 	json_fields = {'info', 'version', 'frames_num', 'faces_num', 'profiles', 'faces',
 		'max_id', 'max_seq_id', 'reassignments', 'merges', 'attributes'}
@@ -41,7 +134,7 @@ class TrackerData:
 		class Image:
 			json_fields = {'mode', 'format', 'width', 'height', 'data', 'features'}
 			def __init__(self, dct = {}): self.__dict__.update(dct)
-		def __init__(self, f):
+		def __init__(self, f, skip_image = False):
 			self.image = None
 			if type(f) is dict:
 				self.__dict__.update(f)
@@ -56,9 +149,21 @@ class TrackerData:
 				self.template = f.read(ts)
 				self.frame_id, self.face_id = read_long(f, 2)
 				if read_byte(f): # is cropped face present ?
-					img = self.image = TrackerData.Face.Image()
-					img.mode, img.format, img.width, img.height, size = read_int(f, 5)
-					img.data, img.features = f.read(size), f.read(70*2*4)
+					if skip_image: # seek past image data and features
+						f.seek(read_int(f, 5)[4] + FSDK_features_size, 1)
+					else:
+						img = self.image = TrackerData.Face.Image()
+						img.mode, img.format, img.width, img.height, size = read_int(f, 5)
+						img.data, img.features = f.read(size), f.read(70*2*4)
+
+		@staticmethod
+		def skip(f):
+			""" seek past the face at the current position of f """
+			id, ts = read_int(f, 2)
+			f.seek(ts + 16, 1)
+			if read_byte(f):
+				f.seek(read_int(f, 5)[4] + FSDK_features_size, 1)
+			return id
 
 		def write_to_binary(face, f):
 			write_int(f, face.id, FSDK_template_size)
@@ -71,114 +176,143 @@ class TrackerData:
 				f.write(img.data)
 				f.write(img.features)
 
+		@classmethod
+		def from_buffer(cls, buf, pos):
+			""" return (face, next position) parsed from buf at pos; template and image data are zero-copy slices of buf """
+			face = cls.__new__(cls)
+			face.id, ts = int2_struct.unpack_from(buf, pos)
+			if ts != FSDK_template_size:
+				raise FSDKTrackerDataError("Incorrect template size")
+			pos += int2_struct.size
+			face.template = buf[pos:pos+ts]
+			face.frame_id, face.face_id, has_image = face_tail_struct.unpack_from(buf, pos+ts)
+			pos += ts + face_tail_struct.size
+			face.image = None
+			if has_image:
+				img = face.image = TrackerData.Face.Image()
+				img.mode, img.format, img.width, img.height, size = int5_struct.unpack_from(buf, pos)
+				pos += int5_struct.size
+				img.data, img.features = buf[pos:pos+size], buf[pos+size:pos+size+FSDK_features_size]
+				pos += size + FSDK_features_size
+			return face, pos
+
 	def __init__(self): pass
 
 	@classmethod
-	def from_binary(cls, filename):
-		""" return new TrackerData object loaded from FaceSDK compatible binary file """
-		def __read_merge(f):
-			size = read_int(f)
-			return dict(name=f.read(size)[:-1].decode('utf-8'), data=read_int(f, read_int(f)//4))
+	def from_binary(cls, filename, use_mmap=False):
+		""" return new TrackerData object loaded from FaceSDK compatible binary file;
+			with use_mmap the file is memory-mapped and templates/images are kept as memoryview slices of it,
+			so the file must not be rewritten while the tracker is in use (see same_file) """
+		if not use_mmap:
+			return cls.from_binary_stream(filename)
 		with open(filename, 'rb') as f:
-			self = TrackerData()
-			if read_int(f) != FSDK_signature:
+			try:
+				buf = memoryview(mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ))
+			except ValueError: # empty file can't be mapped
 				raise FSDKTrackerDataError("Invalid file format")
-			self.version = read_int(f)
-			if self.version != 6:
-				raise FSDKTrackerDataError("Incorrect version of tracker data file: %i" % self.version)
-			self.frames_num, self.faces_num = read_long(f, 2)
-			read_profile = lambda : (read_int(f), f.read(read_int(f))[:-1].decode('utf-8')) # id, name
-			profiles = (read_profile() for p in range(read_int(f)))
-			self.profiles = dict(p for p in profiles if p[1])
-			self.faces = [TrackerData.Face(f) for p in range(read_int(f))]
-			self.max_id, self.max_seq_id = read_int(f, 2)			
-			self.reassignments = [{'reassigned_id': read_int(f), 'new_id': read_int(f)} for r in range(read_int(f))]
-			self.reassign_ids()
-			self.merges = [__read_merge(f) for r in range(read_int(f))]
-			self.attributes = []
+		def read_str(pos):
+			size, = int1_struct.unpack_from(buf, pos)
+			return str(buf[pos+4:pos+3+size], 'utf-8'), pos+4+size
+		try:
+			sig, version = int2_struct.unpack_from(buf, 0)
+		except struct.error:
+			raise FSDKTrackerDataError("Invalid file format")
+		if sig != FSDK_signature:
+			raise FSDKTrackerDataError("Invalid file format")
+		if version != 6:
+			raise FSDKTrackerDataError("Incorrect version of tracker data file: %i" % version)
+		self = TrackerData()
+		self.version = version
+		try:
+			self.frames_num, self.faces_num = long2_struct.unpack_from(buf, 8)
+			pos = 24
+			profiles = {}
+			count, = int1_struct.unpack_from(buf, pos); pos += 4
+			for p in range(count):
+				id, = int1_struct.unpack_from(buf, pos)
+				name, pos = read_str(pos+4)
+				if name: profiles[id] = name
+			self.profiles = profiles
+			count, = int1_struct.unpack_from(buf, pos); pos += 4
+			faces = self.faces = [None]*count
+			from_buffer = TrackerData.Face.from_buffer
+			gc_enabled = gc.isenabled()
+			gc.disable() # faces are acyclic: skip collector passes triggered by the bulk allocation
 			try:
-				for r in range(read_int(f)):
-					self.attributes.append({'id': read_int(f), 'attr_info1': read_int(f), 'attr_info2': read_float(f)})
-			except:
-				print("The file is corrupted: some face attributes were ignored")
+				for i in range(count):
+					faces[i], pos = from_buffer(buf, pos)
+			finally:
+				if gc_enabled: gc.enable()
+			self.max_id, self.max_seq_id = int2_struct.unpack_from(buf, pos); pos += 8
+			count, = int1_struct.unpack_from(buf, pos); pos += 4
+			self.reassignments = [{'reassigned_id': r[0], 'new_id': r[1]} for r in int2_struct.iter_unpack(buf[pos:pos+count*8])]
+			pos += count*8
+			self.reassign_ids()
+			self.merges = []
+			count, = int1_struct.unpack_from(buf, pos); pos += 4
+			for r in range(count):
+				name, pos = read_str(pos)
+				n = int1_struct.unpack_from(buf, pos)[0]//4
+				self.merges.append(dict(name=name, data=struct.unpack_from('=%ii' % n, buf, pos+4)))
+				pos += 4 + n*4
+		except struct.error:
+			raise FSDKTrackerDataError("The file is truncated or corrupted")
+		self.attributes = []
+		try:
+			count, = int1_struct.unpack_from(buf, pos); pos += 4
+			for r in range(count):
+				id, info1, info2 = attribute_struct.unpack_from(buf, pos); pos += attribute_struct.size
+				self.attributes.append({'id': id, 'attr_info1': info1, 'attr_info2': info2})
+		except struct.error:
+			print("The file is corrupted: some face attributes were ignored")
+		self.source_file, self.source_type = filename, 'bin'
+		return self
+
+	@classmethod
+	def from_binary_stream(cls, filename):
+		""" return new TrackerData object loaded from FaceSDK compatible binary file field by field """
+		with open(filename, 'rb') as f:
+			self = TrackerData()
+			self.faces = [TrackerData.Face(f) for p in range(read_header(f, self))]
+			read_trailer(f, self)
+			self.reassign_ids()
 			self.source_file, self.source_type = filename, 'bin'
 			return self
 
 	@classmethod
 	def from_json(cls, filename):
-		""" return new TrackerData object loaded from json file """
-		def hook(dct):
-			if dct.get('info') == TrackerData.info:
-				td = TrackerData()
-				td.__dict__.update(dct)
-				if td.version != 6:
-					raise FSDKTrackerDataError("Tracker version is incorrect: %i" % td.version)
-				td.profiles = {int(key): val for key, val in td.profiles.items() if val}				
-				td.reassign_ids()
-				return td
-			if 'template' in dct: return TrackerData.Face(dct)
-			if TrackerData.Face.Image.json_fields.issubset(dct): return TrackerData.Face.Image(dct)
-			return dct
-		with open(filename, 'r') as f:
-			tracker = json.loads(f.read(), object_hook = hook)
-		if type(tracker) is not TrackerData:
-			raise FSDKTrackerDataError("The json file is not FaceSDK tracker data file or it is corrupted")
+		""" return new TrackerData object loaded from json (or one face per line) file """
+		reader = TrackerJSONReader(filename)
+		tracker = TrackerData()
+		for f in TrackerJSONReader.header_fields: setattr(tracker, f, getattr(reader, f))
+		tracker.reassignments = []
+		tracker.faces = list(reader)
 		tracker.source_file = filename
 		tracker.source_type = 'json'
 		return tracker
 
-	@classmethod
-	def from_file(cls, filename):
+	@staticmethod
+	def is_binary(filename):
 		with open(filename, 'rb') as f:
-			sig = read_int(f)
-		if sig == FSDK_signature:
-			return TrackerData.from_binary(filename)
+			return f.read(4) == struct.pack('i', FSDK_signature)
+
+	@classmethod
+	def from_file(cls, filename, use_mmap=False):
+		if TrackerData.is_binary(filename):
+			return TrackerData.from_binary(filename, use_mmap)
+		if TrackerColumns.is_sidecar(filename):
+			return TrackerColumns.load(filename).to_tracker()
 		return TrackerData.from_json(filename)
 
 	def save_to_binary(self, filename):
 		""" save TrackerData object to FaceSDK compatible binary file """
-		with open(filename, 'wb') as f:
-			write_int(f, FSDK_signature, self.version)
-			write_long(f, self.frames_num, self.faces_num)
-
-			write_int(f, len(self.profiles))
-			for id, name in self.profiles.items():
-				write_int(f, id, len(name)+1)
-				f.write(name.encode())
-				write_byte(f, 0)
-
-			write_int(f, len(self.faces))
-			for face in self.faces: face.write_to_binary(f)
-
-			write_int(f, self.max_id, self.max_seq_id)
-
-			write_int(f, len(self.reassignments))
-			for r in self.reassignments:
-				write_int(f, r['reassigned_id'], r['new_id'])
-
-			write_int(f, len(self.merges))
-			for m in self.merges:
-				write_int(len(m['name'])+1)
-				f.write(m['name'].encode())
-				write_byte(f, 0)
-				write_int(f, len(m['data'])//4, *m['data'])
-
-			write_int(f, len(self.attributes))
-			for m in self.attributes:
-				write_int(f, m['id'], m['attr_info1'])
-				write_float(f, m['attr_info2'])
-
-	def save_to_json(self, filename):
-		""" save TrackerData object to json file """
-		class json_encoder(json.JSONEncoder):
-			def default(self, obj):
-				if hasattr(obj, 'json_fields'):
-					return {f: getattr(obj, f) for f in obj.json_fields if getattr(obj, f) is not None}
-				if type(obj) is bytes:
-					return base64.b64encode(obj).decode('utf-8')
-				return json.JSONEncoder.default(self, obj)
-		with open(filename, 'w') as f:
-			print(json.dumps(self, indent=4, cls = json_encoder), file = f)
+		with TrackerWriter(filename, self) as w:
+			for face in self.faces: w.write(face)
+
+	def save_to_json(self, filename, compact = False):
+		""" save TrackerData object to json file, one face per line if its name ends with .ndjson """
+		with TrackerJSONWriter(filename, self, compact = compact) as w:
+			for face in self.faces: w.write(face)
 
 	def remove_image_data(self):
 		for f in self.faces:
@@ -199,33 +333,39 @@ class TrackerData:
 		self.faces = faces
 		return True
 
-	def __get_faces(self):
+	def __get_faces(self, digests = None):
 		class face_id:
-			def __init__(self, face, name):
-				self.name, self.faces, self.data = name, [face], {face.template}
-			def add_face(self, *face):
-				for f in face:
-					if f.template not in self.data:
-						self.data.add(f.template)
-						self.faces.append(f)
+			def __init__(self, name):
+				self.name, self.faces, self.digests, self.data = name, [], [], set()
+			def add_face(self, face, digest):
+				if digest not in self.data:
+					self.data.add(digest)
+					self.faces.append(face)
+					self.digests.append(digest)
+			def add_faces(self, other):
+				for f, d in zip(other.faces, other.digests): self.add_face(f, d)
 			def has_common(self, face): return self.data & face.data
+		if digests is None:
+			digests = (template_digest(f.template) for f in self.faces)
 		faces = {}
-		for f in self.faces:
-			if f.id in faces:
-				faces[f.id].add_face(f)
-			else:
-				faces[f.id] = face_id(f, self.profiles.get(f.id, ''))
+		for f, d in zip(self.faces, digests):
+			if f.id not in faces:
+				faces[f.id] = face_id(self.profiles.get(f.id, ''))
+			faces[f.id].add_face(f, d)
 		return faces
 
 	def reassign_ids(self):
-		reassignments = {r['reassigned_id'] : r['new_id'] for r in self.reassignments if r['reassigned_id'] != r['new_id']}
+		reassignments = reassignment_map(self.reassignments)
 		for f in self.faces:
 			if f.id in reassignments:
 				f.id = reassignments[f.id]
 		self.reassignments = []
 
-	def merge(self, *tdl):
-		faces = self.__get_faces()
+	def merge(self, *tdl, digests = None):
+		""" merge tdl into this tracker; templates are compared by digests, optionally precomputed
+			as a list per tracker (self first) """
+		digests = digests or [None]*(len(tdl)+1)
+		faces = self.__get_faces(digests[0])
 		names = {v:k for k,v in self.profiles.items()}
 		self.max_id = max(faces.keys()) if faces else 1
 		def iter_faces(faces):
@@ -233,8 +373,8 @@ class TrackerData:
 				for face in f.faces:
 					face.id = id
 					yield face
-		def merge_single(td):
-			faces2 = td.__get_faces()
+		def merge_single(td, digests):
+			faces2 = td.__get_faces(digests)
 			for id2, f2 in faces2.items():
 				if f2.name:
 					if f2.name in names: id2 = names[f2.name]
@@ -245,13 +385,41 @@ class TrackerData:
 				if id2 not in faces: faces[id2] = f2
 				else:
 					if faces[id2].has_common(f2) or f2.name in names:
-				 		faces[id2].add_face(*f2.faces)
+				 		faces[id2].add_faces(f2)
 					else:
 				 		self.max_id += 1
 				 		faces[self.max_id] = f2
-			self.faces = list(iter_faces(faces))
 
-		for td in tdl: merge_single(td)
+		for td, d in zip(tdl, digests[1:]): merge_single(td, d)
+		self.faces = list(iter_faces(faces))
+
+	def unify_similar(self, threshold = 0.95, **options):
+		""" give near-duplicate profiles one id (see similar_profiles), return the list of unified profiles """
+		import numpy as np
+		ids = np.fromiter((f.id for f in self.faces), np.int32, len(self.faces))
+		templates = np.frombuffer(b''.join(f.template for f in self.faces), np.uint8).reshape(-1, FSDK_template_size)
+		mapping, report = similar_profiles(ids, templates, self.profiles, threshold, **options)
+		for f in self.faces:
+			f.id = mapping.get(f.id, f.id)
+		for id in mapping: self.profiles.pop(id, None)
+		return report
+
+	@classmethod
+	def merge_files(cls, filenames, processes = None, use_mmap = False):
+		""" load files and return the first tracker with the rest merged in; json files are decoded and hashed
+			in parallel processes, which pays off with two or more json inputs and as many cores. binary and
+			columnar files are parsed here: sending their faces back from a worker costs more than parsing them """
+		json_files = [fn for fn in filenames if not (TrackerData.is_binary(fn) or TrackerColumns.is_sidecar(fn))]
+		processes = min(processes or os.cpu_count() or 1, len(json_files))
+		loaded = {}
+		if processes >= 2:
+			from multiprocessing import Pool
+			with Pool(processes) as pool:
+				for fn, (td, d) in zip(json_files, pool.map(load_with_digests, json_files)):
+					loaded[fn] = td, [d[i:i+template_digest_size] for i in range(0, len(d), template_digest_size)]
+		trackers = [loaded[fn][0] if fn in loaded else TrackerData.from_file(fn, use_mmap) for fn in filenames]
+		trackers[0].merge(*trackers[1:], digests = [loaded[fn][1] if fn in loaded else None for fn in filenames])
+		return trackers[0]
 
 	def __getattr__(self, item):
 		if item == 'images':
@@ -259,19 +427,616 @@ class TrackerData:
 		raise AttributeError(item)
 
 	def statistics(self):
-		if len(self.faces):
-			with_images = len(self.images)
-			finfo = "{cnt} (with images: {n})".format(cnt = len(self.faces), 
-				n = 'all' if with_images == len(self.faces) else with_images)
+		return statistics_info(self, len(self.faces), len(self.images), len(self.profiles))
+
+
+class TrackerReader:
+	""" streaming reader of FaceSDK binary file: all fields but the faces are loaded up front,
+		faces are yielded one at a time by iterating the reader """
+	def __init__(self, filename, skip_images = False):
+		self.source_file, self.source_type, self.skip_images = filename, 'bin', skip_images
+		with open(filename, 'rb') as f:
+			self.faces_count = read_header(f, self)
+			self.faces_offset = f.tell()
+			for i in range(self.faces_count): TrackerData.Face.skip(f)
+			read_trailer(f, self)
+		self.reassigned = reassignment_map(self.reassignments)
+		self.reassignments = [] # applied to the faces while iterating
+
+	def __iter__(self):
+		with open(self.source_file, 'rb') as f:
+			f.seek(self.faces_offset)
+			for i in range(self.faces_count):
+				face = TrackerData.Face(f, self.skip_images)
+				face.id = self.reassigned.get(face.id, face.id)
+				yield face
+
+
+class TrackerWriter:
+	""" streaming writer of FaceSDK binary file: faces are written one at a time,
+		their count is patched in when the writer is closed """
+	def __init__(self, filename, td, profiles = None):
+		self.td, self.profiles = td, td.profiles if profiles is None else profiles
+		self.faces_count = self.images_count = 0
+		# writing over the file td streams from (a TrackerReader) goes through a temporary file
+		self.filename, self.target = filename, filename
+		if same_file(getattr(td, 'source_file', ''), filename):
+			self.target = filename + '.tmp'
+		self.f = open(self.target, 'wb')
+		write_header(self.f, td, self.profiles)
+		self.count_offset = self.f.tell()
+		write_int(self.f, 0)
+
+	def write(self, face):
+		face.write_to_binary(self.f)
+		self.faces_count += 1
+		self.images_count += face.image is not None
+
+	def close(self):
+		write_trailer(self.f, self.td)
+		self.f.seek(self.count_offset)
+		write_int(self.f, self.faces_count)
+		self.f.close()
+		if self.target != self.filename:
+			os.replace(self.target, self.filename)
+
+	def __enter__(self): return self
+	def __exit__(self, *exc): self.close()
+
+	def statistics(self):
+		return statistics_info(self.td, self.faces_count, self.images_count, len(self.profiles))
+
+
+class JSONScanner:
+	""" decodes json values one at a time from a text file through a sliding buffer """
+	chunk_size = 1 << 20
+	space = re.compile(r'\s*')
+
+	def __init__(self, f):
+		self.f, self.buf, self.pos, self.eof = f, '', 0, False
+
+	def fill(self):
+		""" drop consumed text and read more; the read size doubles while a single value outgrows the buffer """
+		data = self.f.read(max(self.chunk_size, len(self.buf) - self.pos))
+		self.buf, self.pos = self.buf[self.pos:] + data, 0
+		self.eof = not data
+		return not self.eof
+
+	def char(self):
+		""" return the next non-space character without consuming it, '' at the end of file """
+		while True:
+			self.pos = self.space.match(self.buf, self.pos).end()
+			if self.pos < len(self.buf): return self.buf[self.pos]
+			if not self.fill(): return ''
+
+	def take(self, chars):
+		c = self.char()
+		if not c or c not in chars:
+			raise FSDKTrackerDataError("The json file is not FaceSDK tracker data file or it is corrupted")
+		self.pos += 1
+		return c
+
+	def value(self, decoder):
+		self.char()
+		while True:
+			try:
+				value, end = decoder.raw_decode(self.buf, self.pos)
+			except json.JSONDecodeError:
+				end = None
+			# a value touching the end of the buffer (e.g. a number) may continue in the next chunk
+			if end is not None and (end < len(self.buf) or self.eof):
+				self.pos = end
+				return value
+			if not self.fill() and end is None:
+				raise FSDKTrackerDataError("The json file is not FaceSDK tracker data file or it is corrupted")
+
+
+class TrackerJSONReader:
+	""" incremental reader of json tracker file, either a document or a header object followed by one face per line:
+		fields other than faces are loaded up front, faces are yielded one at a time by iterating the reader """
+	header_fields = ('version', 'frames_num', 'faces_num', 'profiles', 'max_id', 'max_seq_id', 'reassignments', 'merges', 'attributes')
+	plain_decoder = json.JSONDecoder()
+
+	@staticmethod
+	def face_hook(dct):
+		if 'template' in dct: return TrackerData.Face(dct)
+		if TrackerData.Face.Image.json_fields.issubset(dct): return TrackerData.Face.Image(dct)
+		return dct
+	face_decoder = json.JSONDecoder(object_hook = face_hook)
+
+	def __init__(self, filename, skip_images = False):
+		self.source_file, self.source_type, self.skip_images = filename, 'json', skip_images
+		header = {}
+		with open(filename, 'r') as f:
+			for key, value in self.__items(f, False):
+				if key != 'face': header[key] = value
+				elif set(self.header_fields).issubset(header): break # the rest are faces
+		if header.get('info') != TrackerData.info or not set(self.header_fields).issubset(header):
+			raise FSDKTrackerDataError("The json file is not FaceSDK tracker data file or it is corrupted")
+		if header['version'] != 6:
+			raise FSDKTrackerDataError("Tracker version is incorrect: %i" % header['version'])
+		for f in self.header_fields: setattr(self, f, header[f])
+		self.profiles = {int(key): val for key, val in self.profiles.items() if val}
+		self.reassigned = reassignment_map(self.reassignments)
+		self.reassignments = [] # applied to the faces while iterating
+
+	def __items(self, f, decode_faces):
+		""" yield (key, value) of the top-level object and ('face', face) for every face;
+			faces are left as plain dicts unless decode_faces """
+		scan = JSONScanner(f)
+		decoder = self.face_decoder if decode_faces else self.plain_decoder
+		face = lambda: ('face', scan.value(decoder))
+		scan.take('{')
+		while scan.char() != '}':
+			key = scan.value(self.plain_decoder)
+			scan.take(':')
+			if key != 'faces':
+				yield key, scan.value(self.plain_decoder)
+			else:
+				scan.take('[')
+				if scan.char() != ']':
+					yield face()
+					while scan.take(',]') == ',': yield face()
+				else:
+					scan.take(']')
+			if scan.take(',}') == '}': break
 		else:
-			finfo = "{}".format(len(self.faces))
-		stat_info = "file version: {v}\nframesNum: {fr}\nfacesNum: {fa}\nprofiles: {pr}\nfaces: {faces}\n"\
-			"max_id: {maxid}\nmax seq id: {mseqid}\nreassignments: {reas}\nmerges: {mgs}\nattributes: {attrs}".format(
-				v = self.version, fr = self.frames_num, fa = self.faces_num, pr = len(self.profiles),
-				faces = finfo, maxid = self.max_id, mseqid = self.max_seq_id,
-				reas = len(self.reassignments), mgs = len(self.merges), attrs = len(self.attributes)
-			)
-		return stat_info
+			scan.take('}')
+		while scan.char(): # one face per line follows the header
+			yield face()
+
+	def __iter__(self):
+		with open(self.source_file, 'r') as f:
+			for key, face in self.__items(f, True):
+				if key == 'face':
+					face.id = self.reassigned.get(face.id, face.id)
+					if self.skip_images: face.image = None
+					yield face
+
+
+class TrackerJSONWriter:
+	""" streaming writer of json tracker file: a document with the faces array last or, for .ndjson files,
+		a header line followed by one face per line; compact drops the indentation """
+	def __init__(self, filename, td, profiles = None, compact = False):
+		self.td, self.profiles = td, td.profiles if profiles is None else profiles
+		self.ndjson = filename.endswith('.ndjson')
+		self.indent = None if compact or self.ndjson else 4
+		self.faces_count = self.images_count = 0
+		header = {'info': TrackerData.info}
+		for f in TrackerJSONReader.header_fields: header[f] = getattr(td, f)
+		header['profiles'] = self.profiles
+		self.f = open(filename, 'w')
+		if self.ndjson:
+			self.f.write(self.dumps(header) + '\n')
+		else: # leave the document open for the faces array
+			self.f.write(self.dumps(header)[:-1].rstrip() + (',\n    "faces": [' if self.indent else ',"faces":['))
+
+	def dumps(self, obj):
+		return json.dumps(obj, indent = self.indent, separators = None if self.indent else (',', ':'), cls = TrackerJSONEncoder)
+
+	def write(self, face):
+		text = self.dumps(face)
+		if self.ndjson:
+			self.f.write(text + '\n')
+		else:
+			if self.indent: text = '\n        ' + text.replace('\n', '\n        ')
+			self.f.write(',' + text if self.faces_count else text)
+		self.faces_count += 1
+		self.images_count += face.image is not None
+
+	def close(self):
+		if not self.ndjson:
+			self.f.write(('\n    ' if self.indent and self.faces_count else '') + (']\n}\n' if self.indent else ']}\n'))
+		self.f.close()
+
+	def __enter__(self): return self
+	def __exit__(self, *exc): self.close()
+
+	def statistics(self):
+		return statistics_info(self.td, self.faces_count, self.images_count, len(self.profiles))
+
+
+def same_file(a, b):
+	""" true when both paths name one existing file """
+	return os.path.exists(a) and os.path.exists(b) and os.path.samefile(a, b)
+
+def open_reader(filename, skip_images = False):
+	""" return streaming reader for binary or json file """
+	return (TrackerReader if TrackerData.is_binary(filename) else TrackerJSONReader)(filename, skip_images)
+
+def open_writer(filename, td, profiles = None, compact = False):
+	""" return streaming writer, json for file names ending with json, binary otherwise """
+	if filename.endswith('json'):
+		return TrackerJSONWriter(filename, td, profiles, compact)
+	return TrackerWriter(filename, td, profiles)
+
+def filter_faces(reader, filename, remove_id = None, extract_id = None, compact = False):
+	""" copy faces of reader to a new file without loading them all, return the closed writer and the profile ids read;
+		when remove_id or extract_id is not found the new file is deleted, and the reader's own file is left as it was """
+	profiles = dict(reader.profiles)
+	if remove_id is not None: profiles.pop(remove_id, None)
+	if extract_id is not None and extract_id in profiles: profiles = {extract_id: profiles[extract_id]}
+	# the reader keeps reading its file while the writer fills the new one
+	root, ext = os.path.splitext(filename) # the writer goes by the extension
+	target = root + '.tmp' + ext if same_file(reader.source_file, filename) else filename
+	ids = set()
+	with open_writer(target, reader, profiles, compact) as w:
+		for face in reader:
+			ids.add(face.id)
+			if face.id != remove_id and (extract_id is None or face.id == extract_id):
+				w.write(face)
+	if (remove_id is not None and remove_id not in ids) or (extract_id is not None and extract_id not in ids - {remove_id}):
+		os.remove(target)
+	elif target != filename:
+		os.replace(target, filename)
+	return w, ids
+
+
+class TrackerColumns:
+	""" columnar tracker faces (requires numpy library): one contiguous template matrix, parallel id arrays
+		and cropped images (data followed by features) packed into a blob indexed by per-face offsets """
+	header_fields = ('version', 'frames_num', 'faces_num', 'max_id', 'max_seq_id', 'merges', 'attributes')
+	signature = b'TRACKCOL'
+	arrays = ('ids', 'frame_ids', 'face_ids', 'templates', 'image_info', 'image_offsets', 'images')
+
+	def __init__(self, td, profiles, **arrays):
+		for f in self.header_fields: setattr(self, f, getattr(td, f))
+		self.reassignments, self.profiles = [], dict(profiles)
+		self.__dict__.update(arrays)
+
+	@classmethod
+	def from_faces(cls, td, faces, count):
+		""" return TrackerColumns with count faces taken from iterable (e.g. TrackerData.faces or TrackerReader) """
+		import numpy as np
+		ids, frame_ids, face_ids = np.empty(count, np.int32), np.empty(count, np.int64), np.empty(count, np.int64)
+		templates = np.empty((count, FSDK_template_size), np.uint8)
+		image_info = np.zeros((count, 4), np.int32) # mode, format, width, height
+		image_offsets = np.zeros(count+1, np.int64) # no image: zero-length slice
+		images = bytearray()
+		for i, face in enumerate(faces):
+			ids[i], frame_ids[i], face_ids[i] = face.id, face.frame_id, face.face_id
+			templates[i] = np.frombuffer(face.template, np.uint8)
+			img = face.image
+			if img:
+				image_info[i] = img.mode, img.format, img.width, img.height
+				images += img.data
+				images += img.features
+			image_offsets[i+1] = len(images)
+		return cls(td, td.profiles, ids = ids, frame_ids = frame_ids, face_ids = face_ids, templates = templates,
+			image_info = image_info, image_offsets = image_offsets, images = np.frombuffer(images, np.uint8))
+
+	@classmethod
+	def from_tracker(cls, td):
+		self = cls.from_faces(td, td.faces, len(td.faces))
+		self.source_type = getattr(td, 'source_type', 'bin')
+		return self
+
+	@classmethod
+	def from_file(cls, filename):
+		if cls.is_sidecar(filename):
+			return cls.load(filename)
+		return cls.from_tracker(TrackerData.from_file(filename, use_mmap=True)) # columns copy the faces
+
+	@classmethod
+	def is_sidecar(cls, filename):
+		with open(filename, 'rb') as f:
+			return f.read(len(cls.signature)) == cls.signature
+
+	def __len__(self): return len(self.ids)
+
+	def has_image(self):
+		return self.image_offsets[1:] != self.image_offsets[:-1]
+
+	def statistics(self):
+		return statistics_info(self, len(self), int(self.has_image().sum()), len(self.profiles))
+
+	def to_tracker(self):
+		""" return TrackerData with Face objects; templates and images are zero-copy views of the columns """
+		td = TrackerData()
+		for f in self.header_fields: setattr(td, f, getattr(self, f))
+		td.reassignments, td.profiles = [], dict(self.profiles)
+		templates, images = memoryview(self.templates.reshape(-1)).toreadonly(), memoryview(self.images).toreadonly()
+		ts, offsets = FSDK_template_size, self.image_offsets.tolist()
+		td.faces = []
+		for i, (id, frame_id, face_id) in enumerate(zip(self.ids.tolist(), self.frame_ids.tolist(), self.face_ids.tolist())):
+			face = TrackerData.Face.__new__(TrackerData.Face)
+			face.id, face.frame_id, face.face_id, face.template = id, frame_id, face_id, templates[i*ts:(i+1)*ts]
+			face.image = None
+			if offsets[i] != offsets[i+1]:
+				img = face.image = TrackerData.Face.Image()
+				img.mode, img.format, img.width, img.height = self.image_info[i].tolist()
+				start, end = offsets[i], offsets[i+1]
+				img.data, img.features = images[start:end-FSDK_features_size], images[end-FSDK_features_size:end]
+			td.faces.append(face)
+		td.source_type = 'bin'
+		return td
+
+	def take(self, rows, profiles = None):
+		""" return TrackerColumns with the faces at rows (index array) in the given order """
+		import numpy as np
+		starts, ends = self.image_offsets[:-1][rows], self.image_offsets[1:][rows]
+		sizes = ends - starts
+		image_offsets = np.zeros(len(rows)+1, np.int64)
+		np.cumsum(sizes, out = image_offsets[1:])
+		# byte index of every kept image byte: start of its image plus position inside it
+		gather = np.repeat(starts - image_offsets[:-1], sizes) + np.arange(image_offsets[-1])
+		return TrackerColumns(self, self.profiles if profiles is None else profiles,
+			ids = self.ids[rows], frame_ids = self.frame_ids[rows], face_ids = self.face_ids[rows],
+			templates = self.templates[rows], image_info = self.image_info[rows],
+			image_offsets = image_offsets, images = self.images[gather])
+
+	@staticmethod
+	def concat(cols):
+		""" return TrackerColumns with the faces of all cols, header of the first one """
+		import numpy as np
+		cat = lambda name: np.concatenate([getattr(c, name) for c in cols])
+		shifts = np.cumsum([0] + [c.image_offsets[-1] for c in cols[:-1]])
+		image_offsets = np.concatenate([c.image_offsets[:-1] + s for c, s in zip(cols, shifts)] + [[sum(c.image_offsets[-1] for c in cols)]])
+		return TrackerColumns(cols[0], cols[0].profiles, ids = cat('ids'), frame_ids = cat('frame_ids'),
+			face_ids = cat('face_ids'), templates = cat('templates'), image_info = cat('image_info'),
+			image_offsets = image_offsets.astype(np.int64), images = cat('images'))
+
+	def remove_image_data(self):
+		import numpy as np
+		self.image_info = np.zeros_like(self.image_info)
+		self.image_offsets, self.images = np.zeros(len(self)+1, np.int64), np.zeros(0, np.uint8)
+
+	def remove_profile(self, id):
+		import numpy as np
+		mask = self.ids != id
+		self.profiles.pop(id, None)
+		if mask.all(): return False
+		self.__dict__.update(self.take(np.flatnonzero(mask)).__dict__)
+		return True
+
+	def extract_profile(self, id):
+		import numpy as np
+		rows = np.flatnonzero(self.ids == id)
+		if not len(rows): return False
+		profiles = {id: self.profiles[id]} if id in self.profiles else self.profiles
+		self.__dict__.update(self.take(rows, profiles).__dict__)
+		return True
+
+	def merge(self, *others):
+		""" TrackerData.merge over columns: templates are compared by integer keys of distinct template rows """
+		import numpy as np
+		cols = (self,) + others
+		merged = TrackerColumns.concat(cols)
+		_, tkeys = np.unique(merged.templates.view(np.dtype((np.void, FSDK_template_size))).ravel(), return_inverse = True)
+		tkeys = tkeys.ravel()
+		class group:
+			def __init__(self, name, rows):
+				# keep the first face of every distinct template, as TrackerData.add_face does
+				keys, first = np.unique(tkeys[rows], return_index = True)
+				self.name, self.rows, self.keys = name, [rows[np.sort(first)]], keys
+			def add_rows(self, other):
+				rows = np.concatenate(other.rows)
+				new = ~np.isin(tkeys[rows], self.keys)
+				self.rows.append(rows[new])
+				self.keys = np.union1d(self.keys, tkeys[rows[new]])
+			def has_common(self, other): return np.isin(other.keys, self.keys).any()
+		def groups(c, base):
+			ids, first, inverse = np.unique(c.ids, return_index = True, return_inverse = True)
+			rows = np.split(np.argsort(inverse.ravel(), kind = 'stable') + base, np.cumsum(np.bincount(inverse.ravel()))[:-1])
+			return {int(ids[k]): group(c.profiles.get(int(ids[k]), ''), rows[k]) for k in np.argsort(first)}
+		bases = np.cumsum([0] + [len(c) for c in cols])
+		faces = groups(self, 0)
+		names = {v:k for k,v in self.profiles.items()}
+		self.max_id = max(faces.keys()) if faces else 1
+		for c, base in zip(others, bases[1:]):
+			for id2, f2 in groups(c, base).items():
+				if f2.name:
+					if f2.name in names: id2 = names[f2.name]
+					elif id2 in faces:
+						self.max_id += 1
+						id2 = self.max_id
+					self.profiles[id2] = f2.name
+				if id2 not in faces: faces[id2] = f2
+				elif faces[id2].has_common(f2) or f2.name in names:
+					faces[id2].add_rows(f2)
+				else:
+					self.max_id += 1
+					faces[self.max_id] = f2
+		rows = [np.concatenate(f.rows) for f in faces.values()]
+		result = merged.take(np.concatenate(rows) if rows else np.zeros(0, np.int64), self.profiles)
+		result.ids = np.repeat(np.array(list(faces.keys()), np.int32), [len(r) for r in rows])
+		max_id = self.max_id
+		self.__dict__.update(result.__dict__)
+		self.max_id = max_id
+
+	def unify_similar(self, threshold = 0.95, **options):
+		""" give near-duplicate profiles one id (see similar_profiles), return the list of unified profiles """
+		import numpy as np
+		mapping, report = similar_profiles(self.ids, self.templates, self.profiles, threshold, **options)
+		pids, inverse = np.unique(self.ids, return_inverse = True)
+		self.ids = np.array([mapping.get(id, id) for id in pids.tolist()], np.int32)[inverse.ravel()]
+		for id in mapping: self.profiles.pop(id, None)
+		return report
+
+	def save(self, filename):
+		""" save memory-mappable sidecar file: signature, json header length and header, 64-byte aligned arrays """
+		header = {f: getattr(self, f) for f in self.header_fields}
+		header['profiles'] = self.profiles
+		layout, offset = {}, 0
+		for name in self.arrays:
+			a = getattr(self, name)
+			layout[name] = (a.dtype.str, a.shape, offset)
+			offset += -(-a.nbytes // 64) * 64
+		header['arrays'] = layout
+		data = json.dumps(header).encode()
+		start = -(-(len(self.signature) + 4 + len(data)) // 64) * 64
+		with open(filename, 'wb') as f:
+			f.write(self.signature)
+			write_int(f, len(data))
+			f.write(data)
+			for name in self.arrays:
+				f.seek(start + layout[name][2])
+				getattr(self, name).tofile(f)
+			f.truncate(start + offset)
+
+	@classmethod
+	def load(cls, filename):
+		""" return TrackerColumns whose arrays are read-only views of the memory-mapped sidecar file """
+		import numpy as np
+		with open(filename, 'rb') as f:
+			if f.read(len(cls.signature)) != cls.signature:
+				raise FSDKTrackerDataError("The file is not a columnar tracker data file")
+			size = read_int(f)
+			header = json.loads(f.read(size).decode())
+			buf = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+		start = -(-(len(cls.signature) + 4 + size) // 64) * 64
+		td = TrackerData()
+		td.__dict__.update({f: header[f] for f in cls.header_fields})
+		arrays = {}
+		for name, (dtype, shape, offset) in header.pop('arrays').items():
+			count = int(np.prod(shape))
+			arrays[name] = np.frombuffer(buf, dtype, count, start + offset).reshape(shape)
+		self = cls(td, {int(k): v for k, v in header['profiles'].items()}, **arrays)
+		self.source_type = 'cols'
+		return self
+
+
+def similar_profiles(ids, templates, profiles, threshold = 0.95, bits = 12, tables = 4, chunk = 2048, seed = 0):
+	""" find profiles whose mean templates are near duplicates (requires numpy library)
+		ids: face profile ids, templates: (faces, template size) uint8 matrix, profiles: {id: name}
+		Templates are compared as centered, normalized byte vectors. Profiles are bucketed by random hyperplane
+		signs (bits per table, several tables) and only profiles sharing a bucket are compared, with one matrix
+		product per bucket chunk. Two differently named profiles are never unified.
+		return ({merged id: kept id}, [(kept id, merged id, similarity), ...]) """
+	import numpy as np
+	pids, inverse, counts = np.unique(ids, return_inverse = True, return_counts = True)
+	if len(pids) < 2:
+		return {}, []
+	order = np.argsort(inverse.ravel(), kind = 'stable')
+	starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+	vectors = np.add.reduceat(templates[order].astype(np.float32), starts) / counts[:, None]
+	vectors -= vectors.mean(axis = 0)
+	vectors /= np.maximum(np.linalg.norm(vectors, axis = 1, keepdims = True), 1e-12)
+	pids = pids.tolist()
+	parent = list(range(len(pids)))
+	named = [profiles.get(id, '') for id in pids]
+	def find(i):
+		while parent[i] != i:
+			parent[i] = parent[parent[i]]
+			i = parent[i]
+		return i
+	unions = []
+	def union(i, j, score):
+		ri, rj = find(i), find(j)
+		if ri == rj or named[ri] and named[rj] and named[ri] != named[rj]:
+			return
+		if not named[ri] and (named[rj] or pids[rj] < pids[ri]): ri, rj = rj, ri # keep named or lower id
+		parent[rj] = ri
+		unions.append((ri, rj, score))
+	rng = np.random.default_rng(seed)
+	weights = 1 << np.arange(bits, dtype = np.int64)
+	for t in range(tables):
+		planes = rng.standard_normal((vectors.shape[1], bits)).astype(np.float32)
+		codes = ((vectors @ planes) > 0) @ weights
+		_, bucket, sizes = np.unique(codes, return_inverse = True, return_counts = True)
+		members = np.split(np.argsort(bucket.ravel(), kind = 'stable'), np.cumsum(sizes)[:-1])
+		for rows in members:
+			if len(rows) < 2: continue
+			block = vectors[rows]
+			for start in range(0, len(rows), chunk):
+				sim = block[start:start+chunk] @ block.T
+				i, j = np.nonzero(sim >= threshold)
+				keep = j > i + start
+				for a, b, score in zip(i[keep] + start, j[keep], sim[i[keep], j[keep]]):
+					union(int(rows[a]), int(rows[b]), float(score))
+	mapping = {pids[i]: pids[find(i)] for i in range(len(pids)) if find(i) != i}
+	report = [(pids[find(ri)], pids[rj], score) for ri, rj, score in unions]
+	return mapping, report
+
+
+def load_with_digests(filename):
+	""" TrackerData.merge_files worker: return the tracker of a json file and its joined template digests """
+	td = TrackerData.from_file(filename)
+	return td, b''.join(template_digest(f.template) for f in td.faces)
+
+
+def synthetic_tracker(faces_num, profiles_num = None, image_every = 4, image_side = 48, shared = None):
+	""" return TrackerData filled with random templates, used by the benchmarks;
+		every third face takes its template from the shared list when it is given """
+	profiles_num = profiles_num or max(1, faces_num//10)
+	td = TrackerData()
+	td.version, td.frames_num, td.faces_num = 6, faces_num, faces_num
+	td.profiles = {id: 'person%i' % id for id in range(1, profiles_num+1, 2)}
+	td.faces = []
+	for i in range(faces_num):
+		face = TrackerData.Face.__new__(TrackerData.Face)
+		face.id, face.template, face.frame_id, face.face_id = i % profiles_num + 1, os.urandom(FSDK_template_size), i, i
+		if shared and i % 3 == 0: face.template = shared[i // 3 % len(shared)]
+		face.image = None
+		if image_every and i % image_every == 0:
+			img = face.image = TrackerData.Face.Image()
+			img.mode, img.format, img.width, img.height = 0, 0, image_side, image_side
+			img.data, img.features = os.urandom(image_side*image_side), os.urandom(FSDK_features_size)
+		td.faces.append(face)
+	td.max_id, td.max_seq_id = profiles_num, faces_num
+	td.reassignments, td.merges, td.attributes = [], [], []
+	return td
+
+
+def benchmark_parsers(faces_num):
+	""" compare field by field and memory-mapped parsing of a synthetic binary file """
+	import tempfile
+	with tempfile.TemporaryDirectory() as tmp:
+		filename = os.path.join(tmp, 'bench.dat')
+		synthetic_tracker(faces_num).save_to_binary(filename)
+		size = os.path.getsize(filename)
+		print("Synthetic file: {} faces, {:.1f} MB".format(faces_num, size/2**20))
+		results = {}
+		for name, use_mmap in (('stream', False), ('mmap', True)):
+			start = time.perf_counter()
+			td = TrackerData.from_binary(filename, use_mmap)
+			elapsed = results[name] = time.perf_counter() - start
+			print("{:>8}: {:.3f}s ({:.0f} faces/s, {:.1f} MB/s)".format(name, elapsed, faces_num/elapsed, size/2**20/elapsed))
+			del td
+		print("speedup: {:.1f}x".format(results['stream']/results['mmap']))
+
+
+def benchmark_merge(files_num, faces_num = 20000, ext = 'json'):
+	""" compare sequential loading and merging of synthetic files with TrackerData.merge_files
+		(the same work for binary files, parallel decoding for json ones) """
+	import tempfile
+	shared = [os.urandom(FSDK_template_size) for i in range(faces_num//10)]
+	with tempfile.TemporaryDirectory() as tmp:
+		filenames = [os.path.join(tmp, 'bench%i.%s' % (i, ext)) for i in range(files_num)]
+		for fn in filenames:
+			td = synthetic_tracker(faces_num, shared = shared)
+			td.save_to_json(fn) if ext == 'json' else td.save_to_binary(fn)
+		print("Synthetic {} files: {} x {} faces".format(ext, files_num, faces_num))
+		start = time.perf_counter()
+		trackers = [TrackerData.from_file(fn) for fn in filenames]
+		trackers[0].merge(*trackers[1:])
+		sequential = time.perf_counter() - start
+		print("sequential: {:.3f}s, {} faces".format(sequential, len(trackers[0].faces)))
+		del trackers
+		start = time.perf_counter()
+		td = TrackerData.merge_files(filenames, max(2, os.cpu_count() or 1))
+		parallel = time.perf_counter() - start
+		print("  parallel: {:.3f}s, {} faces".format(parallel, len(td.faces)))
+		del td
+		print("speedup: {:.1f}x".format(sequential/parallel))
+
+
+def benchmark_similar(profiles_num, duplicates = 0.01, threshold = 0.95):
+	""" time similar_profiles on random profiles, a fraction of them re-captured with small noise """
+	import numpy as np
+	rng = np.random.default_rng(0)
+	dup_num = int(profiles_num * duplicates)
+	base = rng.integers(0, 256, (profiles_num, FSDK_template_size), np.uint8)
+	noise = rng.integers(-4, 5, (dup_num, FSDK_template_size))
+	templates = np.concatenate([base, np.clip(base[:dup_num] + noise, 0, 255).astype(np.uint8)])
+	ids = np.arange(1, len(templates)+1, dtype = np.int32)
+	print("Synthetic profiles: {} with {} near duplicates".format(profiles_num, dup_num))
+	start = time.perf_counter()
+	mapping, report = similar_profiles(ids, templates, {}, threshold)
+	elapsed = time.perf_counter() - start
+	found = sum(1 for id in range(profiles_num+1, len(templates)+1) if mapping.get(id) == id - profiles_num)
+	print("{:.3f}s ({:.0f} profiles/s), duplicates found: {}/{}, unified: {}".format(
+		elapsed, len(templates)/elapsed, found, dup_num, len(mapping)))
 
 
 if __name__ == '__main__':
@@ -280,7 +1045,18 @@ if __name__ == '__main__':
 	skip_image_data = False
 	face_image_id = None
 	remove_id = extract_id = None
+	columnar, sidecar_file, compact = False, '', False
+	similarity = None
 	input_files = [p for p in sys.argv[1:] if not p.startswith('-') or options.append(p)]
+	bench = [o for o in options if o.startswith('-bench')]
+	if bench:
+		if bench[0].startswith('-benchmerge'):
+			for ext in ('json', 'dat'): benchmark_merge(int(bench[0][11:] or 16), ext = ext)
+		elif bench[0].startswith('-benchsimilar'):
+			benchmark_similar(int(bench[0][13:] or 100000))
+		else:
+			benchmark_parsers(int(bench[0][6:] or 100000))
+		exit(0)
 	if not input_files:
 		print("\nFaceSDK Tracker Data converter, version 1.7")
 		print("Usage:")
@@ -291,9 +1067,18 @@ if __name__ == '__main__':
 		print('\t-profileid<id>\textract face images for profile id (requires pillow library)')
 		print('\t-remove<id>\tremove profile id')
 		print('\t-extract<id>\textract profile id')
+		print('\t-compact\twrite json without indentation')
+		print('\t-columnar\tmerge, remove and extract over numpy columns (requires numpy library)')
+		print('\t-cols<file>\talso save the result as memory-mappable columnar file (requires numpy library)')
+		print('\t-similar[<threshold>]\tunify profiles with near-duplicate templates (default 0.95, requires numpy library)')
+		print('\t-bench[<faces>]\tbenchmark binary parsers on a synthetic file (default 100000 faces)')
+		print('\t-benchmerge[<files>]\tbenchmark merging of synthetic json and binary files (default 16 files)')
+		print('\t-benchsimilar[<profiles>]\tbenchmark similarity unification (default 100000 profiles)')
 		print("Note:")
 		print('\tInput and output files are to be of FSDK binary or json formats.')
 		print('\tMultiple input files will be merged.')
+		print('\tA single input is converted face by face in constant memory unless it is merged, unified or columnar.')
+		print('\tJson output files ending with .ndjson get a header line followed by one face per line.')
 		print('\tThe trackerMemoryTool will automatically determine the format of the source file and generate a new file in a different format (.dat -> .json or .json -> .dat) with the name outputfile.json or outputfile.dat')
 		exit(0)
 
@@ -303,6 +1088,10 @@ if __name__ == '__main__':
 		elif o.startswith('-profileid'): face_image_id = int(o[10:])
 		elif o.startswith('-remove'): remove_id = int(o[7:])
 		elif o.startswith('-extract'): extract_id = int(o[8:])
+		elif o.startswith('-columnar'): columnar = True
+		elif o.startswith('-compact'): compact = True
+		elif o.startswith('-similar'): similarity = float(o[8:] or 0.95)
+		elif o.startswith('-cols'): sidecar_file = o[5:]
 		else:
 			raise FSDKTrackerDataError("Unrecognized option '%s'" % o[:2])
 	if not output_file and face_image_id is None:
@@ -310,18 +1099,76 @@ if __name__ == '__main__':
 			output_file = os.path.splitext(input_files[0])[0]+'.'
 		else:
 			raise FSDKTrackerDataError("Output file is not specified")
-	trackers = [TrackerData.from_file(f) for f in input_files]
+	start = time.perf_counter()
+	input_size = sum(os.path.getsize(f) for f in input_files)
+	timing = lambda: "\nDone in {:.2f}s ({:.1f} MB/s of input).".format(time.perf_counter() - start,
+		input_size/2**20/max(time.perf_counter() - start, 1e-9))
+	if len(input_files) == 1 and not (columnar or sidecar_file or similarity is not None or TrackerColumns.is_sidecar(input_files[0])):
+		# filter, strip, extract or convert file to file without loading all faces
+		reader = open_reader(input_files[0], skip_images = skip_image_data)
+		if output_file.endswith('.'):
+			output_file += 'json' if reader.source_type == 'bin' else 'dat'
+		if output_file:
+			w, ids = filter_faces(reader, output_file, remove_id, extract_id, compact)
+			for id, found in ((remove_id, ids), (extract_id, ids - {remove_id})):
+				if id is not None and id not in found:
+					print("Faces with profile id", id, "are not found.")
+					exit(1)
+			print(w.statistics())
+			if same_file(input_files[0], output_file):
+				reader = open_reader(output_file, skip_images = skip_image_data) # the input was replaced
+			if remove_id is not None:
+				print("\nFaces with profile id", remove_id, "are removed.")
+			if extract_id is not None:
+				print("\nFaces with profile id", extract_id, "are extracted.")
+			print("\nFile '{}' is created in {} format.".format(output_file, 'json' if output_file.endswith('json') else 'binary'))
+		if face_image_id is not None:
+			print()
+			found = images = 0
+			if face_image_id != remove_id and extract_id in (None, face_image_id):
+				for face in reader:
+					if face.id != face_image_id: continue
+					found += 1
+					if face.image:
+						from PIL import Image
+						im = Image.frombytes('L', (face.image.width, face.image.height), bytes(face.image.data))
+						fname = "face%s_%s.png"%(face_image_id, face.face_id)
+						im.save(fname)
+						print("Image file", fname, "is created")
+						images += 1
+			if not found:
+				print("Faces with profile id", face_image_id, "are not found.")
+			elif not images:
+				print("Faces with profile id", face_image_id, "do not have images.")
+		print(timing())
+		exit(0)
+
+	# faces loaded with mmap point into their input file: only map inputs that are not overwritten
+	outputs = [output_file + ext for ext in ('json', 'dat')] if output_file.endswith('.') else [output_file]
+	use_mmap = not any(same_file(f, o) for f in input_files for o in outputs + [sidecar_file] if o)
+	if len(input_files) > 1 and not columnar:
+		trackers = [TrackerData.merge_files(input_files, use_mmap = use_mmap)]
+	else:
+		trackers = [TrackerColumns.from_file(f) if columnar else TrackerData.from_file(f, use_mmap) for f in input_files]
 	if skip_image_data:
 		for t in trackers: t.remove_image_data()
 	td = trackers[0]
-	if len(trackers) == 1:
+	if len(input_files) == 1:
 		if output_file.endswith('.'):
 			output_file += 'json' if td.source_type == 'bin' else 'dat'
 	else:
-		td.merge(*trackers[1:])
+		if len(trackers) > 1: td.merge(*trackers[1:])
 		if output_file.endswith('.'):
 			output_file += 'json' if td.source_type == 'json' else 'dat'
 
+	if similarity is not None:
+		start = time.perf_counter()
+		unified = td.unify_similar(similarity)
+		print("Profiles unified by similarity >= {}: {} ({:.2f}s)".format(similarity, len(unified), time.perf_counter() - start))
+		for kept, merged, score in unified:
+			print("\t{} <- {} ({:.3f})".format(kept, merged, score))
+		print()
+
 	if remove_id is not None:
 		if not td.remove_profile(remove_id):
 			print("Faces with profile id", remove_id, "are not found.")
@@ -332,10 +1179,15 @@ if __name__ == '__main__':
 			print("Faces with profile id", extract_id, "are not found.")
 			exit(1)
 
+	if sidecar_file:
+		(td if columnar else TrackerColumns.from_tracker(td)).save(sidecar_file)
+	if columnar:
+		td = td.to_tracker()
+
 	if output_file:
 		outfmt = 'json' if output_file.endswith('json') else 'binary'
 		if outfmt == 'json':
-			td.save_to_json(output_file)
+			td.save_to_json(output_file, compact)
 		else:
 			td.save_to_binary(output_file)
 	print(td.statistics())
@@ -345,6 +1197,8 @@ if __name__ == '__main__':
 		if extract_id is not None:
 			print("\nFaces with profile id", extract_id, "are extracted.")
 		print("\nFile '{}' is created in {} format.".format(output_file, outfmt))
+	if sidecar_file:
+		print("File '{}' is created in columnar format.".format(sidecar_file))
 	if face_image_id is not None:
 		print()
 		faces = [face for face in td.faces if face.id == face_image_id]
@@ -357,8 +1211,9 @@ if __name__ == '__main__':
 			else:
 				from PIL import Image
 				for face in faces:
-					im = Image.frombytes('L', (face.image.width, face.image.height), face.image.data)
+					im = Image.frombytes('L', (face.image.width, face.image.height), bytes(face.image.data))
 					fname = "face%s_%s.png"%(face_image_id, face.face_id)
 					im.save(fname)
 					print("Image file", fname, "is created")
 
+	print(timing())
@@ -0,0 +1,322 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from multiprocessing import Pool
+
+import numpy as np
+
+import appMetrics
+
+log = appMetrics.getLogger()
+
+# closed elections are moved out of votedtb into a directory of compressed
+# columnar chunk files plus a manifest:
+#   archive/<election>/manifest.json
+#   archive/<election>/chunk-00000.vac ...
+# a chunk is the magic, a length-prefixed JSON directory of its columns and
+# the zlib-compressed columns. strings with few distinct values (PartCode,
+# Image, Constituency) are dictionary-encoded so a tally only inflates two
+# small code columns; the hash chain columns are read only for verification.
+# rows are ordered by constituency and id, and the manifest keeps for every
+# chunk its sha256 and the first Hash1 / last Hash2 of each constituency in
+# it, so chunks verify independently and are stitched together afterwards
+ARCHIVE_DIR = os.environ.get('VOTE_ARCHIVE_DIR', 'archive')
+CHUNK_ROWS = 65536
+MAGIC = b'VOTEARC1'
+COLUMNS = ('id', 'VoterId', 'PartCode', 'Image', 'count', 'Hash1', 'Hash2', 'Constituency', 'CastTime')
+DICT_COLUMNS = ('PartCode', 'Image', 'Constituency')
+# CastTime is kept as epoch seconds, -1 for votes cast before the column existed
+INT_COLUMNS = ('id', 'count', 'CastTime')
+SELECT = dict((c, c) for c in COLUMNS)
+SELECT['CastTime'] = 'UNIX_TIMESTAMP(CastTime)'
+
+
+def _encode_chunk(rows):
+    cols = list(zip(*rows))
+    directory, blobs, offset = {}, [], 0
+    for i, name in enumerate(COLUMNS):
+        values = cols[i]
+        if name in INT_COLUMNS:
+            data = np.asarray([-1 if v is None else int(v) for v in values], dtype='<i8').tobytes()
+            entry = {'kind': 'int64'}
+        elif name in DICT_COLUMNS:
+            words = sorted(set(values))
+            index = dict((w, n) for n, w in enumerate(words))
+            data = np.asarray([index[v] for v in values], dtype='<u4').tobytes()
+            entry = {'kind': 'dict', 'words': words}
+        else:
+            data = '\0'.join(values).encode()
+            entry = {'kind': 'str'}
+        blob = zlib.compress(data, 6)
+        entry['offset'], entry['length'] = offset, len(blob)
+        directory[name] = entry
+        blobs.append(blob)
+        offset += len(blob)
+    head = json.dumps({'rows': len(rows), 'columns': directory}, sort_keys=True).encode()
+    return MAGIC + struct.pack('<I', len(head)) + head + b''.join(blobs)
+
+
+class Chunk(object):
+    """Memory-mapped chunk file; columns are inflated on demand."""
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:8] != MAGIC:
+            raise ValueError('%s is not a vote archive chunk' % filename)
+        size = struct.unpack('<I', self._map[8:12])[0]
+        head = json.loads(self._map[12:12 + size])
+        self._base = 12 + size
+        self.rows = head['rows']
+        self.columns = head['columns']
+
+    def _raw(self, name):
+        entry = self.columns[name]
+        start = self._base + entry['offset']
+        with memoryview(self._map) as view:
+            return zlib.decompress(view[start:start + entry['length']])
+
+    def codes(self, name):
+        """(codes array, dictionary) of a dictionary-encoded column"""
+        return np.frombuffer(self._raw(name), dtype='<u4'), self.columns[name]['words']
+
+    def column(self, name):
+        entry = self.columns[name]
+        if entry['kind'] == 'int64':
+            return np.frombuffer(self._raw(name), dtype='<i8')
+        if entry['kind'] == 'dict':
+            codes, words = self.codes(name)
+            return [words[c] for c in codes]
+        raw = self._raw(name)
+        return raw.decode().split('\0') if self.rows else []
+
+    def close(self):
+        self._map.close()
+
+
+def _tally_chunk(filename):
+    chunk = Chunk(filename)
+    try:
+        const, consts = chunk.codes('Constituency')
+        part, parts = chunk.codes('PartCode')
+        counts = np.bincount(const.astype(np.int64) * len(parts) + part, minlength=len(consts) * len(parts))
+        result = {}
+        for i, c in enumerate(consts):
+            row = counts[i * len(parts):(i + 1) * len(parts)]
+            result[c] = dict((p, int(n)) for p, n in zip(parts, row) if n)
+        return result
+    finally:
+        chunk.close()
+
+
+def _verify_chunk(filename):
+    # (sha256 of the file, {constituency: (first Hash1, last Hash2)}, broken ids, error)
+    with open(filename, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    try:
+        chunk = Chunk(filename)
+        try:
+            ids = chunk.column('id')
+            consts = chunk.column('Constituency')
+            hash1 = chunk.column('Hash1')
+            hash2 = chunk.column('Hash2')
+        finally:
+            chunk.close()
+    except (ValueError, KeyError, zlib.error) as e:
+        return digest, None, [], str(e)
+    ends, broken = {}, []
+    prev_const = None
+    for i in range(len(consts)):
+        c = consts[i]
+        if c != prev_const:
+            ends[c] = [hash1[i], hash2[i]]
+            prev_const = c
+        else:
+            if hash1[i] != hash2[i - 1]:
+                broken.append(int(ids[i]))
+            ends[c][1] = hash2[i]
+    return digest, dict((c, tuple(e)) for c, e in ends.items()), broken, None
+
+
+def _map(func, args, processes):
+    processes = min(processes or os.cpu_count() or 1, len(args))
+    if processes < 2:
+        return [func(a) for a in args]
+    with Pool(processes) as pool:
+        return pool.map(func, args)
+
+
+class Archive(object):
+    """Read-only view of an archived election."""
+
+    def __init__(self, election, archive_dir=ARCHIVE_DIR, manifest='manifest.json'):
+        self.path = os.path.join(archive_dir, election)
+        with open(os.path.join(self.path, manifest)) as f:
+            self.manifest = json.load(f)
+
+    def _files(self):
+        return [os.path.join(self.path, c['file']) for c in self.manifest['chunks']]
+
+    def tally(self, processes=None):
+        """Same result as voteTally.tally: (total, per PartCode, per constituency and PartCode)."""
+        with appMetrics.timed('archive_seconds', op='tally'):
+            results = _map(_tally_chunk, self._files(), processes)
+        merged, total = {}, {}
+        for result in results:
+            for c, counts in result.items():
+                votes = merged.setdefault(c, {})
+                for p, n in counts.items():
+                    votes[p] = votes.get(p, 0) + n
+                    total[p] = total.get(p, 0) + n
+        return sum(total.values()), total, merged
+
+    def verify(self, processes=None):
+        """Problems found, an empty list when the archive verifies."""
+        with appMetrics.timed('archive_seconds', op='verify'):
+            results = _map(_verify_chunk, self._files(), processes)
+        problems = []
+        tips = {}
+        for meta, (digest, ends, broken, error) in zip(self.manifest['chunks'], results):
+            expected = dict((c, tuple(e)) for c, e in meta['chains'].items())
+            if digest != meta['sha256']:
+                problems.append('%s: checksum mismatch' % meta['file'])
+            if error:
+                # stitch past it with the manifest's ends
+                problems.append('%s: unreadable (%s)' % (meta['file'], error))
+                ends = expected
+            elif ends != expected:
+                problems.append('%s: chain ends differ from the manifest' % meta['file'])
+            problems.extend('%s: vote %d breaks the chain' % (meta['file'], vid) for vid in broken)
+            # stitch each constituency's chain across chunks
+            for c, (first, last) in ends.items():
+                if first != tips.get(c, '0'):
+                    problems.append('%s: chain of %s does not continue' % (meta['file'], c))
+                tips[c] = last
+        # a constituency whose votes predate chaintb and got none since has
+        # no row there, and nothing to compare
+        if any(tips.get(c, '0') != tip for c, tip in self.manifest['tips'].items()):
+            problems.append('chain tips differ from chaintb at archive time')
+        return problems
+
+
+def elections(archive_dir=ARCHIVE_DIR):
+    if not os.path.isdir(archive_dir):
+        return []
+    return sorted(d for d in os.listdir(archive_dir) if os.path.exists(os.path.join(archive_dir, d, 'manifest.json')))
+
+
+def archive(connect, election, archive_dir=ARCHIVE_DIR, chunk_rows=CHUNK_ROWS, purge=False):
+    """Writes votedtb and the chain tips into archive/<election>.
+
+    The archive is verified against the table before purge empties votedtb
+    and chaintb for the next election."""
+    path = os.path.join(archive_dir, election)
+    if os.path.exists(os.path.join(path, 'manifest.json')):
+        raise ValueError('election %s is already archived' % election)
+    os.makedirs(path, exist_ok=True)
+    start = time.time()
+    chunks = []
+    try:
+        arc = _write(connect, election, archive_dir, chunk_rows, chunks)
+        # published only once it verifies, so a failed run can be repeated
+        problems = arc.verify()
+        if problems:
+            raise ValueError('archive of %s does not verify: %s' % (election, '; '.join(problems[:5])))
+    except Exception:
+        for name in [c['file'] for c in chunks] + ['manifest.tmp']:
+            if os.path.exists(os.path.join(path, name)):
+                os.remove(os.path.join(path, name))
+        raise
+    os.replace(os.path.join(path, 'manifest.tmp'), os.path.join(path, 'manifest.json'))
+    log.info("archived %d votes of %s in %d chunks (%.1fs)", arc.manifest['rows'], election, len(chunks),
+             time.time() - start)
+    if purge:
+        _purge(connect, arc.manifest['last_id'])
+    return arc
+
+
+def _write(connect, election, archive_dir, chunk_rows, chunks):
+    # the chunks and manifest.tmp; chunks is filled as they are written
+    path = os.path.join(archive_dir, election)
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT Constituency, Tip FROM chaintb")
+        tips = dict(cursor.fetchall())
+        cursor.execute("SELECT max(id) FROM votedtb")
+        last_id = cursor.fetchone()[0] or 0
+        cursor.execute("SELECT " + ', '.join(SELECT[c] for c in COLUMNS) + " FROM votedtb where id<=%s"
+                       " order by Constituency, id",
+                       (last_id,))
+        rows = 0
+        while True:
+            batch = cursor.fetchmany(chunk_rows)
+            if not batch:
+                break
+            batch = [tuple(r) for r in batch]
+            name = 'chunk-%05d.vac' % len(chunks)
+            data = _encode_chunk(batch)
+            with open(os.path.join(path, name), 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            ends = {}
+            for r in batch:
+                ends.setdefault(r[7], [r[5], r[6]])[1] = r[6]
+            chunks.append({'file': name, 'rows': len(batch), 'sha256': hashlib.sha256(data).hexdigest(),
+                           'chains': ends})
+            rows += len(batch)
+    finally:
+        conn.close()
+
+    manifest = {'election': election, 'archived': time.strftime('%Y-%m-%d %H:%M:%S'), 'rows': rows,
+                'last_id': last_id, 'chunk_rows': chunk_rows, 'columns': COLUMNS, 'tips': tips, 'chunks': chunks}
+    with open(os.path.join(path, 'manifest.tmp'), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return Archive(election, archive_dir, 'manifest.tmp')
+
+
+def _purge(connect, last_id, batch=10000):
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        while True:
+            cursor.execute("DELETE FROM votedtb where id<=%s limit %s", (last_id, batch))
+            conn.commit()
+            if cursor.rowcount < batch:
+                break
+        cursor.execute("DELETE FROM chaintb")
+        # the turnout of the archived election goes with it
+        cursor.execute("DELETE FROM turnouttb")
+        cursor.execute("UPDATE regcounttb set Untimed=0")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    # python voteArchive.py archive <election> [-purge] | tally <election> | verify <election> | list
+    import mysql.connector
+
+    def connect():
+        return mysql.connector.connect(user='root', password='', host=os.environ.get('VOTE_DB_HOST', 'localhost'),
+                                       database='3facefingervoteencdb')
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else 'list'
+    if cmd == 'archive':
+        arc = archive(connect, sys.argv[2], purge='-purge' in sys.argv[3:])
+        print("%d votes in %d chunks" % (arc.manifest['rows'], len(arc.manifest['chunks'])))
+    elif cmd == 'tally':
+        total, parties, _ = Archive(sys.argv[2]).tally()
+        print(total, json.dumps(parties, sort_keys=True))
+    elif cmd == 'verify':
+        problems = Archive(sys.argv[2]).verify()
+        print('\n'.join(problems) or 'OK')
+        sys.exit(1 if problems else 0)
+    else:
+        print('\n'.join(elections()))
@@ -0,0 +1,348 @@
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+
+import appMetrics
+import voteTally
+import voteTurnout
+
+log = appMetrics.getLogger()
+
+# optional vote-ingest mode: uvote appends the vote to a local write-ahead
+# journal and answers once it is on disk, a background flusher moves the
+# journaled votes into votedtb in order, extending the hash chain.
+# enabled by pointing VOTE_JOURNAL at the journal file
+JOURNAL_FILE = os.environ.get('VOTE_JOURNAL', '')
+# extra time a group waits for more votes before its fsync (seconds);
+# 0 still groups every vote that arrived while the previous fsync ran
+GROUP_WAIT = float(os.environ.get('VOTE_JOURNAL_WAIT', '0'))
+FLUSH_BATCH = 500
+FLUSH_INTERVAL = 0.05
+# the journal is truncated once everything in it is in votedtb and it has
+# grown past this size
+COMPACT_BYTES = 1 << 20
+
+
+def encode(rec):
+    body = json.dumps(rec, sort_keys=True, separators=(',', ':')).encode()
+    return b'%08x %s\n' % (zlib.crc32(body), body)
+
+
+def decode(line):
+    """Returns the record of one journal line, None for a torn or corrupt one."""
+    if len(line) < 10 or not line.endswith(b'\n') or line[8:9] != b' ':
+        return None
+    body = line[9:-1]
+    try:
+        if int(line[:8], 16) != zlib.crc32(body):
+            return None
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+class VoteJournal(object):
+    """Group-committed vote journal in front of votedtb.
+
+    connect() returns a new DB-API connection, sign() the Hash2 of the next
+    row. Only one flusher may extend the chain of a table, so run a single
+    journal per votedtb."""
+
+    def __init__(self, filename, connect, sign, table='votedtb', chain='chaintb'):
+        self.filename = filename
+        self.applied_file = filename + '.applied'
+        self.connect = connect
+        self.sign = sign
+        self.table = table
+        self.chain = chain
+        # scratch tables (the benchmark) stay out of the turnout counters
+        self.turnout = table == 'votedtb'
+        self._cond = threading.Condition()
+        self._io = threading.Lock()
+        self._pending = []
+        self._unapplied = []
+        self._voters = set()
+        self._error = None
+        self._closed = False
+        self._applied = self._read_applied()
+        self._seq = self._durable = self._applied
+        self._replay()
+        self._fh = open(filename, 'ab')
+        self._writer = threading.Thread(target=self._write_loop, name='vote-journal-writer')
+        self._flusher = threading.Thread(target=self._flush_loop, name='vote-journal-flusher')
+        self._writer.daemon = self._flusher.daemon = True
+        self._writer.start()
+        self._flusher.start()
+
+    def _read_applied(self):
+        try:
+            with open(self.applied_file) as f:
+                return int(f.read().strip() or 0)
+        except (IOError, OSError, ValueError):
+            return 0
+
+    def _write_applied(self, seq):
+        tmp = self.applied_file + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(str(seq))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.applied_file)
+
+    def _replay(self):
+        # votes that were acknowledged but never reached votedtb; a torn
+        # tail from a crash mid-write is cut off so new records follow
+        # the last good one
+        if not os.path.exists(self.filename):
+            return
+        good = 0
+        with open(self.filename, 'rb') as f:
+            for line in f:
+                rec = decode(line)
+                if rec is None:
+                    break
+                good += len(line)
+                self._seq = max(self._seq, rec['seq'])
+                if rec['seq'] > self._applied:
+                    self._unapplied.append(rec)
+                    self._voters.add(rec['vid'])
+        if good != os.path.getsize(self.filename):
+            log.warning("vote journal %s: dropping torn tail at byte %d", self.filename, good)
+            with open(self.filename, 'r+b') as f:
+                f.truncate(good)
+        self._durable = self._seq
+        if self._unapplied:
+            log.info("vote journal %s: replaying %d votes", self.filename, len(self._unapplied))
+
+    def has_voted(self, vid):
+        """True while a vote of vid is journaled but not yet in votedtb."""
+        with self._cond:
+            return vid in self._voters
+
+    def append(self, vid, part, image, constituency=''):
+        """Journals a vote and returns once it is durable.
+
+        False when the voter already has a vote in the journal."""
+        with self._cond:
+            if self._error is not None:
+                raise IOError('vote journal failed: %s' % self._error)
+            if vid in self._voters:
+                return False
+            self._voters.add(vid)
+            self._seq += 1
+            rec = {'seq': self._seq, 'vid': vid, 'part': part, 'image': image,
+                   'const': constituency, 'ts': time.time()}
+            self._pending.append(rec)
+            self._cond.notify_all()
+            while self._durable < rec['seq'] and self._error is None:
+                self._cond.wait()
+            if self._durable < rec['seq']:
+                raise IOError('vote journal failed: %s' % self._error)
+        return True
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+            if GROUP_WAIT:
+                time.sleep(GROUP_WAIT)
+            with self._io:
+                with self._cond:
+                    batch, self._pending = self._pending, []
+                try:
+                    with appMetrics.timed('journal_fsync_seconds'):
+                        self._fh.write(b''.join(encode(r) for r in batch))
+                        self._fh.flush()
+                        os.fsync(self._fh.fileno())
+                except (IOError, OSError) as e:
+                    log.error("vote journal write failed", exc_info=True)
+                    with self._cond:
+                        self._error = e
+                        for r in batch:
+                            self._voters.discard(r['vid'])
+                        self._cond.notify_all()
+                    return
+            appMetrics.inc('journal_votes_total', len(batch))
+            appMetrics.inc('journal_groups_total')
+            with self._cond:
+                self._durable = batch[-1]['seq']
+                self._unapplied.extend(batch)
+                self._cond.notify_all()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                if not self._unapplied:
+                    if self._closed and not self._pending:
+                        return
+                    self._cond.wait(FLUSH_INTERVAL)
+                batch = self._unapplied[:FLUSH_BATCH]
+            if not batch:
+                continue
+            try:
+                with appMetrics.timed('journal_apply_seconds'):
+                    self._apply(batch)
+            except Exception:
+                # the votes stay in the journal, try again later
+                log.warning("vote journal flush of %d votes failed", len(batch), exc_info=True)
+                time.sleep(1)
+                continue
+            self._write_applied(batch[-1]['seq'])
+            with self._cond:
+                del self._unapplied[:len(batch)]
+                self._applied = batch[-1]['seq']
+                for r in batch:
+                    self._voters.discard(r['vid'])
+                self._cond.notify_all()
+            self._compact()
+
+    def _apply(self, batch):
+        # one chain per constituency, each continued from its tip; the
+        # chains are locked in a fixed order so flushers on several nodes
+        # cannot deadlock, and before the VoterId check so that it sees
+        # votes other nodes committed for these voters
+        conn, tips = voteTally.lock_chains(self.connect, [r.get('const', '') for r in batch], self.table, self.chain)
+        try:
+            # idempotent: a vote whose VoterId is already in the table was
+            # applied before a crash lost the watermark
+            cursor = conn.cursor()
+            vids = [r['vid'] for r in batch]
+            cursor.execute("SELECT VoterId FROM " + self.table + " where VoterId in ("
+                           + ','.join(['%s'] * len(vids)) + ") for update", vids)
+            done = set(row[0] for row in cursor.fetchall())
+            rows = []
+            turnout = {}
+            for r in batch:
+                if r['vid'] in done:
+                    continue
+                done.add(r['vid'])
+                const = r.get('const', '')
+                hash2 = self.sign()
+                rows.append((r['vid'], r['part'], r['image'], tips[const], hash2, const, r['ts']))
+                tips[const] = hash2
+                key = (const, voteTurnout.bucket(r['ts']))
+                turnout[key] = turnout.get(key, 0) + 1
+            if rows:
+                cursor.executemany("insert into " + self.table + " (VoterId, PartCode, Image, count, Hash1, Hash2,"
+                                   " Constituency, CastTime) values (%s, %s, %s, '1', %s, %s, %s, FROM_UNIXTIME(%s))",
+                                   rows)
+            for const, tip in tips.items():
+                voteTally.advance(conn, const, tip, self.chain)
+            if self.turnout:
+                voteTurnout.record(conn, turnout)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _compact(self):
+        with self._io:
+            with self._cond:
+                if self._pending or self._unapplied or self._durable != self._applied:
+                    return
+                if self._fh.tell() < COMPACT_BYTES:
+                    return
+                self._fh.truncate(0)
+                self._fh.seek(0)
+                os.fsync(self._fh.fileno())
+
+    def backlog(self):
+        with self._cond:
+            return len(self._unapplied)
+
+    def close(self):
+        """Stops accepting votes and waits until the journal is applied."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join()
+        self._flusher.join()
+        self._fh.close()
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def enabled():
+    return bool(JOURNAL_FILE)
+
+
+def get(connect, sign):
+    global _journal
+    if _journal is None:
+        with _journal_lock:
+            if _journal is None:
+                _journal = VoteJournal(JOURNAL_FILE, connect, sign)
+    return _journal
+
+
+def benchmark(connect, sign, votes=2000, threads=32, filename='bench.journal'):
+    """votes/sec of direct insert+commit against the journal, both into
+    a scratch copy of votedtb"""
+    conn = connect()
+    cursor = conn.cursor()
+    for table in ('votedtb', 'chaintb'):
+        cursor.execute("DROP TABLE IF EXISTS " + table + "_bench")
+        cursor.execute("CREATE TABLE " + table + "_bench LIKE " + table)
+    conn.commit()
+    conn.close()
+
+    def run(vote):
+        per = votes // threads
+
+        def worker(t):
+            for i in range(per):
+                vote('bench-%d-%d' % (t, i))
+        ts = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+        start = time.time()
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+        return per * threads / (time.time() - start)
+
+    def direct(vid):
+        # what uvote does: lock the tip, insert, advance, commit
+        c, tips = voteTally.lock_chains(connect, [''], 'votedtb_bench', 'chaintb_bench')
+        tip = tips['']
+        hash2 = sign()
+        c.cursor().execute("insert into votedtb_bench (VoterId, PartCode, Image, count, Hash1, Hash2)"
+                           " values (%s, 'B', 'b.png', '1', %s, %s)", (vid, tip, hash2))
+        voteTally.advance(c, '', hash2, 'chaintb_bench')
+        c.commit()
+        c.close()
+
+    print("direct : %8.1f votes/s" % run(direct))
+    for f in (filename, filename + '.applied'):
+        if os.path.exists(f):
+            os.remove(f)
+    journal = VoteJournal(filename, connect, sign, table='votedtb_bench', chain='chaintb_bench')
+    rate = run(lambda vid: journal.append('j' + vid, 'B', 'b.png'))
+    start = time.time()
+    journal.close()
+    print("journal: %8.1f votes/s acknowledged, drained in %.2fs" % (rate, time.time() - start))
+
+
+if __name__ == '__main__':
+    # python voteJournal.py [votes] [threads]
+    import hmac
+    import hashlib
+    import random
+    import mysql.connector
+
+    def connect():
+        return mysql.connector.connect(user='root', password='', host='localhost',
+                                       database='3facefingervoteencdb')
+
+    def sign():
+        key = bytes.fromhex("E49756B4C8FAB4E48222A3E7F3B97CC3")
+        return hmac.new(key, str(random.randrange(1111, 9999)).encode(), hashlib.sha256).hexdigest().upper()
+
+    args = [int(a) for a in sys.argv[1:]]
+    benchmark(connect, sign, *args)
@@ -0,0 +1,186 @@
+import os
+import sys
+import time
+from collections import Counter
+from multiprocessing.pool import ThreadPool
+
+import appMetrics
+
+log = appMetrics.getLogger()
+
+# votedtb is partitioned by constituency (the voter's Address) and every
+# constituency keeps its own Hash1/Hash2 chain, so counting and chain
+# verification split into independent per-constituency jobs that run on
+# their own connections and are merged at the end
+WORKERS = int(os.environ.get('VOTE_TALLY_WORKERS', '0')) or None
+
+
+# (chain table, constituency) pairs whose chaintb row this process has seen
+_seeded = set()
+
+
+def ensure_chains(connect, constituencies, table='votedtb', chain='chaintb'):
+    """Creates the missing chaintb rows from the last Hash2 in votedtb ('0' if none).
+
+    Runs and commits on its own connection, so callers do it before their
+    transaction takes any lock with chain_tip()."""
+    missing = sorted(set(c for c in constituencies if (chain, c) not in _seeded))
+    if not missing:
+        return
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        for constituency in missing:
+            cursor.execute("INSERT IGNORE INTO " + chain + " (Constituency, Tip) SELECT %s, COALESCE((SELECT Hash2 FROM "
+                           + table + " where Constituency=%s order by id desc limit 1), '0')",
+                           (constituency, constituency))
+        conn.commit()
+    finally:
+        conn.close()
+    _seeded.update((chain, c) for c in missing)
+
+
+def chain_tip(conn, constituency, table='votedtb', chain='chaintb'):
+    """Locks the chain of a constituency and returns its tip.
+
+    The row lock on chaintb is what orders votes across app nodes; it is held
+    until the caller commits, so the vote must be inserted and the tip moved
+    with advance() in that same transaction. The row must exist, see
+    ensure_chains() and lock_chains()."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT Tip FROM " + chain + " where Constituency=%s for update", (constituency,))
+    row = cursor.fetchone()
+    if row is None:
+        # chaintb was emptied (an archive purge) since this process seeded
+        # it: none of its rows is trusted any more
+        _seeded.difference_update([key for key in _seeded if key[0] == chain])
+        raise LookupError('no %s row for constituency %r, ensure_chains() first' % (chain, constituency))
+    return row[0]
+
+
+def lock_chains(connect, constituencies, table='votedtb', chain='chaintb'):
+    """Seeds the chains, then locks them in a fixed order on a new connection: (conn, {constituency: tip}).
+
+    A chain row that an archive purge removed after this process seeded it
+    is seeded again and the locking repeated, once; the caller goes on with
+    the returned transaction as after chain_tip()."""
+    constituencies = sorted(set(constituencies))
+    for attempt in (0, 1):
+        ensure_chains(connect, constituencies, table, chain)
+        conn = connect()
+        try:
+            return conn, dict((c, chain_tip(conn, c, table, chain)) for c in constituencies)
+        except LookupError:
+            # the gap lock of the missing row goes with the rollback
+            conn.rollback()
+            conn.close()
+            if attempt:
+                raise
+        except Exception:
+            conn.close()
+            raise
+
+
+def advance(conn, constituency, tip, chain='chaintb'):
+    conn.cursor().execute("UPDATE " + chain + " set Tip=%s where Constituency=%s", (tip, constituency))
+
+
+def constituencies(connect, table='votedtb'):
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT distinct Constituency FROM " + table)
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def count_partition(connect, constituency, table='votedtb'):
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT PartCode, count(*) FROM " + table + " where Constituency=%s group by PartCode",
+                       (constituency,))
+        return constituency, dict(cursor.fetchall())
+    finally:
+        conn.close()
+
+
+def verify_partition(connect, constituency, table='votedtb'):
+    """ids of the votes whose Hash1 does not continue the chain."""
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, Hash1, Hash2 FROM " + table + " where Constituency=%s order by id",
+                       (constituency,))
+        broken = []
+        prev = '0'
+        for vid, hash1, hash2 in cursor:
+            if hash1 != prev:
+                broken.append(vid)
+            prev = hash2
+        return constituency, broken
+    finally:
+        conn.close()
+
+
+def _map(func, connect, workers, table):
+    parts = constituencies(connect, table)
+    if not parts:
+        return []
+    workers = min(workers or WORKERS or os.cpu_count() or 1, len(parts))
+    job = lambda c: func(connect, c, table)
+    if workers < 2:
+        return [job(c) for c in parts]
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(job, parts)
+    finally:
+        pool.close()
+
+
+def tally(connect, workers=None, table='votedtb'):
+    """Returns (total, votes per PartCode, votes per constituency and PartCode)."""
+    with appMetrics.timed('tally_seconds', op='count'):
+        results = dict(_map(count_partition, connect, workers, table))
+    total = Counter()
+    for counts in results.values():
+        total.update(counts)
+    return sum(total.values()), dict(total), results
+
+
+def verify(connect, workers=None, table='votedtb'):
+    """Returns {constituency: [broken vote ids]} for the chains that do not verify."""
+    with appMetrics.timed('tally_seconds', op='verify'):
+        results = _map(verify_partition, connect, workers, table)
+    broken = dict((c, ids) for c, ids in results if ids)
+    if broken:
+        log.warning("vote chain broken in %d constituencies", len(broken))
+    return broken
+
+
+def benchmark(connect, workers=(1, 2, 4, 8), rounds=3):
+    """counting and verification time for each worker count"""
+    parts = constituencies(connect)
+    print("%d constituencies, %d cpus" % (len(parts), os.cpu_count() or 1))
+    for w in workers:
+        for name, func in (('count', tally), ('verify', verify)):
+            best = None
+            for i in range(rounds):
+                start = time.time()
+                func(connect, w)
+                t = time.time() - start
+                best = t if best is None else min(best, t)
+            print("%-6s workers=%-3d %8.3fs" % (name, w, best))
+
+
+if __name__ == '__main__':
+    # python voteTally.py [workers ...]
+    import mysql.connector
+
+    def connect():
+        return mysql.connector.connect(user='root', password='', host='localhost',
+                                       database='3facefingervoteencdb')
+
+    args = tuple(int(a) for a in sys.argv[1:])
+    benchmark(connect, *((args,) if args else ()))
@@ -0,0 +1,116 @@
+import datetime
+import os
+import sys
+import time
+from collections import Counter
+
+import appMetrics
+
+log = appMetrics.getLogger()
+
+# turnout per constituency and time bucket. the vote paths add to turnouttb
+# in the same transaction as the vote and registration keeps regcounttb, so
+# a turnout curve is read from a few counter rows instead of joining regtb
+# against votedtb. backfill() rebuilds both from the base tables
+BUCKET_MINUTES = int(os.environ.get('VOTE_TURNOUT_BUCKET', '15'))
+
+
+def bucket(ts=None):
+    ts = time.time() if ts is None else ts
+    step = BUCKET_MINUTES * 60
+    return datetime.datetime.fromtimestamp(ts - ts % step).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def record(conn, counts):
+    """Adds {(constituency, bucket): votes} inside the caller's transaction."""
+    if counts:
+        conn.cursor().executemany(
+            "INSERT INTO turnouttb (Constituency, Bucket, Votes) values (%s, %s, %s)"
+            " ON DUPLICATE KEY UPDATE Votes=Votes+VALUES(Votes)",
+            [(c, b, n) for (c, b), n in sorted(counts.items())])
+
+
+def vote(conn, constituency, ts=None):
+    record(conn, {(constituency, bucket(ts)): 1})
+
+
+def registered(conn, constituency, n):
+    """Moves the registered count of a constituency by n (+1 / -1)."""
+    conn.cursor().execute("INSERT INTO regcounttb (Constituency, Registered) values (%s, %s)"
+                          " ON DUPLICATE KEY UPDATE Registered=Registered+VALUES(Registered)", (constituency, n))
+
+
+def curve(conn, constituency=None):
+    """{constituency: {'registered', 'voted', 'ratio', 'curve': [[bucket, votes, cumulative]]}}"""
+    cursor = conn.cursor()
+    where, params = '', ()
+    if constituency:
+        where, params = " where Constituency=%s", (constituency,)
+    cursor.execute("SELECT Constituency, Registered, Untimed FROM regcounttb" + where, params)
+    result = dict((c, {'registered': int(n), 'voted': int(u), 'curve': []}) for c, n, u in cursor.fetchall())
+    cursor.execute("SELECT Constituency, Bucket, Votes FROM turnouttb" + where + " order by Constituency, Bucket", params)
+    for c, b, n in cursor.fetchall():
+        entry = result.setdefault(c, {'registered': 0, 'voted': 0, 'curve': []})
+        entry['voted'] += int(n)
+        entry['curve'].append([str(b), int(n), entry['voted']])
+    for entry in result.values():
+        entry['ratio'] = round(entry['voted'] / float(entry['registered']), 4) if entry['registered'] else None
+    return result
+
+
+def backfill(connect, fetch=10000):
+    """Rebuilds regcounttb and turnouttb from regtb and votedtb in one streaming pass each.
+
+    Votes from before votedtb had CastTime have no bucket; they are kept
+    in regcounttb.Untimed and count towards the total but not the curve."""
+    start = time.time()
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        regs = Counter()
+        cursor.execute("SELECT Address FROM regtb")
+        while True:
+            rows = cursor.fetchmany(fetch)
+            if not rows:
+                break
+            regs.update(r[0] for r in rows)
+        votes = Counter()
+        untimed = Counter()
+        cursor.execute("SELECT Constituency, CastTime FROM votedtb")
+        while True:
+            rows = cursor.fetchmany(fetch)
+            if not rows:
+                break
+            for c, when in rows:
+                if when is None:
+                    untimed[c] += 1
+                else:
+                    votes[(c, bucket(time.mktime(when.timetuple())))] += 1
+        cursor.execute("DELETE FROM regcounttb")
+        cursor.execute("DELETE FROM turnouttb")
+        cursor.executemany("INSERT INTO regcounttb (Constituency, Registered, Untimed) values (%s, %s, %s)",
+                           [(c, regs[c], untimed[c]) for c in sorted(set(regs) | set(untimed))])
+        record(conn, votes)
+        conn.commit()
+    finally:
+        conn.close()
+    log.info("turnout backfill: %d constituencies, %d buckets, %d untimed votes in %.1fs",
+             len(regs), len(votes), sum(untimed.values()), time.time() - start)
+    return len(regs), len(votes)
+
+
+if __name__ == '__main__':
+    # python voteTurnout.py backfill | show [constituency]
+    import json
+    import mysql.connector
+
+    def connect():
+        return mysql.connector.connect(user='root', password='', host=os.environ.get('VOTE_DB_HOST', 'localhost'),
+                                       database='3facefingervoteencdb')
+
+    if sys.argv[1:2] == ['backfill']:
+        print("%d constituencies, %d buckets" % backfill(connect))
+    else:
+        conn = connect()
+        print(json.dumps(curve(conn, sys.argv[2] if len(sys.argv) > 2 else None), indent=1, sort_keys=True))
+        conn.close()
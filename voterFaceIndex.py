@@ -0,0 +1,95 @@
+import os
+import threading
+from trackerMemoryTool import TrackerData, TrackerReader
+
+# voter face profiles: LiveRecognition names every enrolled face with the VoterId
+# and saves the tracker memory here; facetb keeps VoterId -> tracker profile id
+license_key = "fVrFCzYC5wOtEVspKM/zfLWVcSIZA4RNqx74s+QngdvRiCC7z7MHlSf2w3+OUyAZkTFeD4kSpfVPcRVIqAKWUZzJG975b/P4HNNzpl11edXGIyGrTO/DImoZksDSRs6wktvgr8lnNCB5IukIPV5j/jBKlgL5aqiwSfyCR8UdC9s="
+trackerMemoryFile = "tracker70.dat"
+MatchFAR = 0.001
+
+_templates = {}
+_loaded = None
+_templates_lock = threading.Lock()
+_fsdk = None
+
+
+def rebuild(conn, tracker_file=trackerMemoryFile):
+    """Rebuild facetb from every enrolled voter whose VoterId names a tracker profile."""
+    if not os.path.exists(tracker_file):
+        raise IOError('tracker memory %s not found, run LiveRecognition to enroll faces first' % tracker_file)
+    profiles = {name: id for id, name in TrackerReader(tracker_file).profiles.items()}
+    cursor = conn.cursor()
+    cursor.execute("SELECT VoterId FROM regtb")
+    rows = [(vid, profiles[vid]) for (vid,) in cursor.fetchall() if vid in profiles]
+    cursor.execute("truncate table facetb")
+    cursor.executemany("insert into facetb values(%s, %s)", rows)
+    conn.commit()
+    return len(rows)
+
+
+def link(conn, vid, tracker_file=trackerMemoryFile):
+    """Store the tracker profile named vid for a newly enrolled voter, return its id or None."""
+    if not os.path.exists(tracker_file):
+        return None
+    for id, name in TrackerReader(tracker_file).profiles.items():
+        if name == vid:
+            cursor = conn.cursor()
+            cursor.execute("replace into facetb values(%s, %s)", (vid, id))
+            conn.commit()
+            return id
+    return None
+
+
+def profile_id(conn, vid):
+    cursor = conn.cursor()
+    cursor.execute("SELECT ProfileId FROM facetb where VoterId=%s", (vid,))
+    data = cursor.fetchone()
+    return data[0] if data else None
+
+
+def profile_templates(pid, tracker_file=trackerMemoryFile):
+    """Templates of one profile; the tracker is mapped and grouped by profile once per file change."""
+    global _templates, _loaded
+    state = (tracker_file, os.path.getmtime(tracker_file))
+    with _templates_lock:
+        if _loaded != state:
+            templates = {}
+            # copies, not views of a mapping: LiveRecognition rewrites the file in place
+            for face in TrackerData.from_binary(tracker_file, use_mmap=False).faces:
+                templates.setdefault(face.id, []).append(bytes(face.template))
+            _templates, _loaded = templates, state
+        return _templates.get(pid, [])
+
+
+def facesdk():
+    global _fsdk
+    if _fsdk is None:
+        import fsdk
+        fsdk.FSDK.ActivateLibrary(license_key)
+        fsdk.FSDK.Initialize()
+        _fsdk = fsdk
+    return _fsdk
+
+
+def verify(conn, vid, image_path, tracker_file=trackerMemoryFile):
+    """1:1 check of a face image against the voter's own templates.
+
+    Returns None when the voter has no linked profile (the caller falls back
+    to 1:N recognition), otherwise True/False.
+    """
+    pid = profile_id(conn, vid)
+    if pid is None:
+        return None
+    templates = profile_templates(pid, tracker_file)
+    if not templates:
+        return None
+    fsdk = facesdk()
+    FSDK = fsdk.FSDK
+    img = FSDK.LoadImageFromFile(image_path)
+    try:
+        probe = img.GetFaceTemplate()
+    finally:
+        img.Free()
+    threshold = FSDK.GetMatchingThresholdAtFAR(MatchFAR)
+    return any(FSDK.MatchFaces(probe, fsdk.FaceTemplate.from_buffer_copy(bytes(t))) >= threshold for t in templates)
@@ -0,0 +1,103 @@
+import re
+import sys
+import time
+
+import appMetrics
+
+# admin voter search over regtb. every query is answered from an index:
+# VoterId / AadharId by exact match, names by the Names full-text index
+# (word prefixes) or, for words shorter than the full-text minimum, by a
+# prefix range on UserName or FatherName; Address narrows any of them.
+# results are ordered by (UserName, VoterId) and paged by keyset. an
+# address-only search walks the (Address, UserName, VoterId) key; name
+# matches are sorted on every page, and full-text ones are capped at the
+# first FT_CAP in that order: a name matching more voters than that is
+# reported as truncated and needs more words or an address
+PAGE_SIZE = 50
+# innodb_ft_min_token_size
+FT_MIN = 3
+FT_CAP = 2000
+# no key or image columns leave the database
+COLUMNS = ('UserName', 'FatherName', 'Gender', 'Age', 'Email', 'Phone', 'Address', 'VoterId', 'AadharId')
+
+
+def _words(q):
+    # full-text boolean operators are not searchable text
+    return [w for w in re.split(r'[\s+\-<>()~*"@]+', q) if w]
+
+
+def _looks_like_id(q):
+    return bool(re.match(r'^[A-Za-z0-9/]+$', q)) and any(ch.isdigit() for ch in q)
+
+
+def _select(cursor, where, params, address, after, limit, cap=None):
+    # returns (rows, truncated); truncated when more than cap rows match
+    if address:
+        where.append("Address=%s")
+        params.append(address)
+    source = "regtb"
+    truncated = False
+    if cap:
+        cursor.execute("SELECT count(*) FROM (SELECT 1 FROM regtb where " + ' and '.join(where)
+                       + " limit %s) t", params + [int(cap) + 1])
+        truncated = cursor.fetchone()[0] > cap
+        # bound the matches before they are sorted; the same first cap rows
+        # of the key order on every page, so keyset pages stay consistent
+        source = ("(SELECT " + ', '.join(COLUMNS) + " FROM regtb where " + ' and '.join(where)
+                  + " order by UserName, VoterId limit " + str(int(cap)) + ") m")
+        where = []
+    if after:
+        where.append("(UserName>%s or (UserName=%s and VoterId>%s))")
+        params = params + [after[0], after[0], after[1]]
+    cursor.execute("SELECT " + ', '.join(COLUMNS) + " FROM " + source + (" where " + ' and '.join(where) if where else "")
+                   + " order by UserName, VoterId limit %s", params + [limit])
+    return cursor.fetchall(), truncated
+
+
+def search(conn, q='', address='', after=None, limit=PAGE_SIZE):
+    """Returns (rows, after, truncated) where after is the keyset of the next
+    page or None and truncated is set when a full-text name matched more than
+    FT_CAP voters, of which only the first FT_CAP are paged.
+
+    after is the (UserName, VoterId) of the last row of the previous page."""
+    q = (q or '').strip()
+    cursor = conn.cursor()
+    with appMetrics.timed('voter_search_seconds'):
+        if q and _looks_like_id(q) and after is None:
+            rows = []
+            for column in ('VoterId', 'AadharId'):
+                rows.extend(_select(cursor, [column + "=%s"], [q], address, None, limit)[0])
+            if rows:
+                seen = set()
+                rows = [r for r in rows if not (r[7] in seen or seen.add(r[7]))]
+                return rows[:limit], None, False
+        words = _words(q)
+        long_words = [w for w in words if len(w) >= FT_MIN]
+        where, params = [], []
+        if long_words:
+            where.append("MATCH (UserName, FatherName) AGAINST (%s IN BOOLEAN MODE)")
+            params.append(' '.join('+' + w + '*' for w in long_words))
+        for w in words:
+            if len(w) < FT_MIN:
+                prefix = w.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                where.append("(UserName like %s or FatherName like %s)")
+                params.extend([prefix, prefix])
+        if not where and not address:
+            return [], None, False
+        rows, truncated = _select(cursor, where, params, address, after, limit + 1, FT_CAP if long_words else None)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, (rows[-1][0], rows[-1][7]), truncated
+    return rows, None, truncated
+
+
+if __name__ == '__main__':
+    # python voterSearch.py <query> [address]
+    import mysql.connector
+    conn = mysql.connector.connect(user='root', password='', host='localhost', database='3facefingervoteencdb')
+    start = time.time()
+    rows, after, truncated = search(conn, sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else '')
+    for row in rows:
+        print(row)
+    print("%d rows in %.1f ms%s%s" % (len(rows), (time.time() - start) * 1000, ', more' if after else '',
+                                      ', truncated at %d' % FT_CAP if truncated else ''))